@@ -1,41 +1,42 @@
 import os
 import uuid
 import io
+import functools
+import math
+import mmap
+import multiprocessing
+import re
+import queue
+import shutil
+import mimetypes
 import requests
+from urllib.parse import urlsplit
 import json
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, jsonify
-from flask_restful import Api, Resource
-from werkzeug.utils import secure_filename
-from werkzeug.exceptions import BadRequest, InternalServerError, RequestURITooLarge
-from markitdown import MarkItDown
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Request, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+import orjson
+from werkzeug.exceptions import BadRequest, InternalServerError, RequestEntityTooLarge, RequestURITooLarge
 from pathlib import Path
-from pdfminer.pdfparser import PDFSyntaxError # 用于捕获PDF页数解析错误
-from pdfminer.pdfdocument import PDFTextExtractionNotAllowed # 用于捕获PDF页数解析错误
 import logging
-from docx_validator import validate_and_output_json
+from docx_validator import load_rules, validate_and_output_json
 logging.getLogger("pdfminer").setLevel(logging.ERROR)
 
 import time
-from time import sleep
+import threading
 
-# 尝试导入 openai，如果需要 LLM 功能
-try:
-    # from openai import AzureOpenAI
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-try:
-    from openai import AzureOpenAI
-except ImportError:
-    AzureOpenAI = None
 from contextlib import contextmanager
-from enum import Enum
 
 # --- 配置 ---
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 100 MB
 MAX_PDF_PAGES = 500
-SUPPORTED_MIMETYPES = [
+SMALL_PDF_BYTES = 8 * 1024 * 1024  # 正常文本密度下小于该大小的 PDF 不会超过 MAX_PDF_PAGES，跳过页数预检
+IO_BUFFER_SIZE = 1024 * 1024  # 上传/下载读写缓冲区大小，减少大文件的系统调用次数
+# 不超过该大小的上传直接留在内存中交给解析进程，省去落盘再读回；
+# 与 SMALL_PDF_BYTES 一致，这样内存中的 PDF 也不需要页数预检
+IN_MEMORY_UPLOAD_BYTES = 8 * 1024 * 1024
+SUPPORTED_MIMETYPES = frozenset({
     # 文档格式
     'application/pdf',  # PDF
     'application/vnd.openxmlformats-officedocument.wordprocessingml.document',  # Word
@@ -82,8 +83,9 @@ SUPPORTED_MIMETYPES = [
     
     #eml
     'message/rfc822',
-]
-MAX_WORKERS = 8 # 最大并发线程数
+})
+MAX_WORKERS = 32 # I/O 线程池最大并发线程数（下载、落盘、校验）
+CPU_WORKERS = os.cpu_count() or 1 # 解析进程池大小，CPU 密集的解析按核数并行
 
 
 # 删除这行，因为已经重复定义了
@@ -94,173 +96,531 @@ UPLOAD_FOLDER = Path(__file__).parent / 'uploads'
 if not UPLOAD_FOLDER.exists():
     UPLOAD_FOLDER.mkdir(parents=True)
 
+_FN_RE = re.compile(r'[^A-Za-z0-9._-]')  # 文件名白名单之外的字符一律替换为 '_'
+
+def _safe(name):
+    """把上传/下载的文件名转换为可安全落盘的名字，保留扩展名供 markitdown 识别格式"""
+    stem, ext = os.path.splitext(_FN_RE.sub('_', name))
+    return (stem[:120] + ext[:8]) or 'file'
+
+def _safe_unlink(path):
+    """删除临时文件，只需一次系统调用：文件不存在视为已清理，其他错误记录日志。返回是否实际删除"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        app.logger.error("无法删除临时文件 %s: %s", path, e)
+        return False
+
+class UploadRequest(Request):
+    """multipart 中的大文件直接流式写入 UPLOAD_FOLDER，避免内存缓冲和 file.save() 的二次拷贝；
+    小文件保留在内存中"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= IN_MEMORY_UPLOAD_BYTES:
+            return io.BytesIO()
+        part_path = UPLOAD_FOLDER / f"{uuid.uuid4()}.part"
+        if not hasattr(self, '_part_paths'):
+            self._part_paths = []
+        self._part_paths.append(part_path)
+        return open(part_path, 'w+b', buffering=IO_BUFFER_SIZE)
+
+    def close(self):
+        super().close()
+        # 未被 upload() 认领（重命名）的分片文件在请求结束时删除
+        for part_path in getattr(self, '_part_paths', ()):
+            _safe_unlink(part_path)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """使用 orjson 序列化响应，解析结果可能是数 MB 的 Markdown 文本，C 实现的编码器快得多"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # 直接把 orjson 输出的 bytes 作为响应体，省去 decode/encode 往返
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.json = OrjsonProvider(app)
+# 大小限制由 Werkzeug 在读取请求体时强制执行，超限直接返回 413，不会落盘
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
-api = Api(app)
 
 # --- 异步任务处理 ---
-executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-from dataclasses import dataclass
-# import threading
+# I/O 与解析分池：下载/校验在线程池中进行，CPU 密集（受 GIL 限制）的解析交给进程池，
+# 这样并发的 URL 下载不会占满解析槽位，解析吞吐也能随核数扩展
+class QueueFull(Exception):
+    """后台任务积压已达上限"""
+
 
-@dataclass
+class BoundedExecutor:
+    """限制积压任务数的线程池：ThreadPoolExecutor 的内部队列没有上限，
+    突发上传时每个排队任务都占着临时文件和元数据，超过上限直接拒绝而不是无限排队"""
+
+    def __init__(self, max_workers, max_pending):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._semaphore = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._semaphore.acquire(blocking=False):
+            raise QueueFull()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(lambda _: self._semaphore.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class RestartingProcessPool:
+    """子进程被 OOM kill 或崩溃后 ProcessPoolExecutor 会永久不可用，之后每次提交都抛 BrokenProcessPool；
+    Web 进程仍在响应请求，gunicorn 也不会重启它。这里发现池损坏时换一个新池：
+    提交时池已损坏则在新池上重新提交（该任务与崩溃无关）；随旧池一起失败的运行中任务
+    照常把 BrokenProcessPool 交给调用方按错误处理，不自动重试（可能正是它导致了崩溃）"""
+
+    def __init__(self, max_workers, mp_context):
+        self._max_workers = max_workers
+        self._mp_context = mp_context
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self._max_workers, mp_context=self._mp_context)
+
+    def _replace(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                app.logger.error("解析进程池中有子进程异常退出，重建进程池")
+                self._executor = self._new_executor()
+                broken.shutdown(wait=False, cancel_futures=True)
+            return self._executor
+
+    def _check_broken(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace(executor)
+
+    def submit(self, fn, *args, **kwargs):
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            executor = self._replace(executor)
+            future = executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(functools.partial(self._check_broken, executor))
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+MAX_PENDING_TASKS = int(math.ceil(MAX_WORKERS * 1.5))  # 运行中 + 排队中的任务总数上限
+# 同时进行的 URL 下载数上限：批量提交时避免下载占满全部 I/O 线程和出口带宽
+MAX_CONCURRENT_DOWNLOADS = MAX_WORKERS // 2
+_download_slots = threading.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+io_executor = BoundedExecutor(max_workers=MAX_WORKERS, max_pending=MAX_PENDING_TASKS)
+# 本进程运行着几十个 I/O 线程，fork 会把其他线程持有的锁状态一并复制进子进程（3.12+ 会告警），
+# 解析子进程改由 forkserver（不支持时用 spawn）启动
+_mp_context = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+cpu_executor = RestartingProcessPool(max_workers=CPU_WORKERS, mp_context=_mp_context)
+from dataclasses import dataclass, field
+from cachetools import TTLCache
+
+@dataclass(slots=True)
 class TaskStatus:
     status: str
     result: str = None
     error: str = None
     metadata: dict = None
     timestamp: float = None  # 新增字段，记录任务创建时间戳
+    result_path: str = None  # 解析结果落盘路径，result 为空时从这里按需读取
+    done: threading.Event = field(default_factory=threading.Event)  # 任务进入 success/error 终态时置位
 
-tasks = {}  # {task_id: TaskStatus}
 TASK_EXPIRE_SECONDS = 7200  # 2小时
+MAX_TASKS = 10_000  # 任务表容量上限，超出后淘汰最早的任务
+# TTLCache 在访问时按 key 惰性淘汰过期任务，不再需要每次查询都全表扫描
+
+def _remove_result_file(task_status):
+    if task_status.result_path:
+        _safe_unlink(task_status.result_path)
+
+class _TaskCache(TTLCache):
+    """任务过期或因容量被淘汰时，同时删除其落盘的解析结果"""
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, task_status in expired:
+            _remove_result_file(task_status)
+        return expired
+
+    def popitem(self):
+        key, task_status = super().popitem()
+        _remove_result_file(task_status)
+        return key, task_status
+
+tasks = _TaskCache(maxsize=MAX_TASKS, ttl=TASK_EXPIRE_SECONDS)  # {task_id: TaskStatus}
+_tasks_lock = threading.RLock()  # TTLCache 本身不是线程安全的
+
+# 配置 REDIS_URL 后任务状态同时写入 Redis（由 Redis 负责过期），
+# gunicorn 多 worker 部署时任意 worker 都能查询到其他 worker 创建的任务
+REDIS_URL = os.environ.get("REDIS_URL", "")
+if REDIS_URL:
+    import redis
+    _redis = redis.Redis.from_url(REDIS_URL)
+else:
+    _redis = None
+
+def _task_key(task_id):
+    return f"task:{task_id}"
+
+def _dump_task(task_status):
+    return json.dumps({
+        "status": task_status.status,
+        "result": task_status.result,
+        "error": task_status.error,
+        "metadata": task_status.metadata,
+        "timestamp": task_status.timestamp,
+        "result_path": task_status.result_path,
+    }, ensure_ascii=False)
+
+def _load_task(raw):
+    task_status = TaskStatus(**json.loads(raw))
+    if task_status.status in ('success', 'error'):
+        task_status.done.set()
+    return task_status
+
+def set_task(task_id, task_status):
+    """保存任务状态；任务状态变化后需再次调用，以便同步到 Redis"""
+    with _tasks_lock:
+        tasks[task_id] = task_status
+    if _redis is not None:
+        try:
+            _redis.set(_task_key(task_id), _dump_task(task_status), ex=TASK_EXPIRE_SECONDS)
+        except Exception as e:
+            # Redis 只是镜像，写入失败时以本进程的任务表为准，不影响任务本身
+            app.logger.warning("同步任务 %s 到 Redis 失败: %s", task_id, e)
 
-# def set_task(task_id, task_status):
-#     tasks[task_id] = task_status
+def delete_task(task_id):
+    with _tasks_lock:
+        task_status = tasks.pop(task_id, None)
+    if task_status is not None:
+        _remove_result_file(task_status)
+    if _redis is not None:
+        _redis.delete(_task_key(task_id))
 
 def get_task(task_id):
-    now = time.time()
-    task_status=tasks.get(task_id)
-    # 清理过期任务
-    expired = [k for k, v in tasks.items() if v.get('timestamp') and now - v.get('timestamp') > TASK_EXPIRE_SECONDS]
-    for k in expired:
-        del tasks[k]
+    # 优先返回本进程内的任务对象（带有可等待的 done 事件），否则再查询 Redis
+    with _tasks_lock:
+        task_status = tasks.get(task_id)
+    if task_status is None and _redis is not None:
+        raw = _redis.get(_task_key(task_id))
+        if raw is not None:
+            task_status = _load_task(raw)
     return task_status
 
-# def cleanup_tasks():
-#     while True:
-#         now = time.time()
-#         expired = [k for k, v in tasks.items() if v.timestamp and now - v.timestamp > TASK_EXPIRE_SECONDS]
-#         for k in expired:
-#             del tasks[k]
-#         time.sleep(600)  # 每10分钟清理一次
+def read_task_result(task_status):
+    """返回解析结果文本；结果已落盘时按需读取"""
+    if task_status.result is None and task_status.result_path:
+        try:
+            return Path(task_status.result_path).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+    return task_status.result
+
+TASK_SWEEP_INTERVAL = 600  # 每10分钟清理一次
+
+# 任务落盘的文件：解析结果、上传分片、任务输入（上传/下载文件以任务 ID 开头）
+_TASK_FILE_PATTERNS = ('*.md', '*.part', '????????-????-????-????-????????????_*')
 
-# threading.Thread(target=cleanup_tasks, daemon=True).start()
+def cleanup_stale_files():
+    """删除 UPLOAD_FOLDER 中超过任务有效期的文件。
+
+    落盘文件平时随任务过期在本进程内删除；worker 重启或崩溃后，它留下的文件不再有任务指向，
+    这里按修改时间兜底清理。超过有效期的文件对应的任务一定已经过期，多个 worker 同时清理也无妨。
+    """
+    cutoff = time.time() - TASK_EXPIRE_SECONDS
+    for pattern in _TASK_FILE_PATTERNS:
+        for path in UPLOAD_FOLDER.glob(pattern):
+            try:
+                if path.stat().st_mtime < cutoff and _safe_unlink(path):
+                    app.logger.info("删除过期文件: %s", path)
+            except FileNotFoundError:
+                pass
+
+def cleanup_tasks():
+    # TTLCache 只在写入或访问时淘汰过期项；没有新任务时由后台线程定期释放过期结果占用的内存。
+    # 启动时先清理上一个进程遗留的过期文件，之后每轮顺带检查一次
+    while True:
+        cleanup_stale_files()
+        time.sleep(TASK_SWEEP_INTERVAL)
+        with _tasks_lock:
+            tasks.expire()
+
+# 解析子进程（forkserver/spawn）会重新导入本模块，只在服务进程中启动清理线程
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=cleanup_tasks, daemon=True).start()
 
 # --- MarkItDown 实例 ---
 # 根据请求参数动态创建 MarkItDown 实例
-from typing import Dict, Optional, Union
-
-def get_markitdown_instance(args: Dict[str, str]) -> MarkItDown:
-    DEFAULT_LLM_PROMPT="""你是一个专业的图片转换器，你需要根据图片中的内容判断是否符合以下某几个场景，输出markdown文本或者图片描述。
-    场景一：使用markdown语法，将图片中识别到的文字转换为markdown格式输出。你必须做到：
-    1. 输出和使用识别到的图片的相同的语言，例如，识别到英语的字段，输出的内容必须是英语。
-    2. 不要解释和输出无关的文字，直接输出图片中的内容。例如，严禁输出 “以下是我根据图片内容生成的markdown文本：”这样的例子，而是应该直接输出markdown。
-    3. 内容不要包含在```markdown ```中、段落公式使用 $$ $$ 的形式、行内公式使用 $ $ 的形式、忽略掉长直线、忽略掉页码。再次强调，不要解释和输出无关的文字，直接输出图片中的内容。
-    4. 对于图中文本之间包含特定关系，需使用思维导图、流程图等mermaid形式的mardown输出，保留文本之间的关联关系。
-    5. 对于图中的表格，需使用markdown表格的形式输出，保留表格结构。  
-    6. 忽略所有水印信息。
-    7. 文字中所有标红或者加粗或其它突出的部分，请用markdown的** **的格式标粗。
-    场景二：请对图片上的非文本元素（图表、照片、人像等）进行描述和总结。语言请参考"场景一"使用的语言，不存在“场景一”请使用中文。
+from typing import TYPE_CHECKING, Any, Dict, Tuple
+
+if TYPE_CHECKING:
+    # 仅供类型标注；运行时 markitdown 由 _import_markitdown 延迟导入
+    from markitdown import MarkItDown
+
+@functools.lru_cache(maxsize=None)
+def _import_markitdown():
+    """延迟导入 markitdown：它会连带加载 PIL、pdfminer、azure 等重量级依赖，
+    只处理状态查询的 worker 不需要为此付出启动时间和内存"""
+    import markitdown
+    return markitdown
+
+@functools.lru_cache(maxsize=16)
+def _get_azure_openai_client(api_key, endpoint, api_version):
+    """同一组配置的 AzureOpenAI 客户端只创建一次，复用其连接池（免去每次请求的 TLS 握手）"""
+    # 仅在需要 LLM 功能时导入 openai，未安装时由调用方降级为不使用 LLM
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_key=api_key,
+        azure_endpoint=endpoint,
+        api_version=api_version
+    )
+
+@functools.lru_cache(maxsize=16)
+def _get_openai_client(api_key, base_url):
+    """同一组配置的 OpenAI 客户端只创建一次，复用其连接池"""
+    from openai import OpenAI
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url
+    )
+
+def _azure_openai_client():
+    openai_api_key = os.environ.get("AZURE_OPENAI_API_KEY","")
+    openai_api_base = os.environ.get("AZURE_OPENAI_ENDPOINT","")
+    openai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION", "2025-02-01-preview")
+
+    if not openai_api_key or not openai_api_base:
+        raise BadRequest("缺少 Azure OpenAI 配置，请设置环境变量。")
+    return _get_azure_openai_client(openai_api_key, openai_api_base, openai_api_version)
+
+def _openai_client():
+    openai_api_key = os.environ.get("OPENAI_API_KEY","")
+    openai_api_base = os.environ.get("OPENAI_API_BASE", "")
+    if not openai_api_key:
+        raise BadRequest("缺少 OpenAI 配置，请设置 OPENAI_API_KEY 环境变量。")
+    return _get_openai_client(openai_api_key, openai_api_base)
+
+@functools.lru_cache(maxsize=32)
+def _build_md(enable_plugins, docintel_endpoint, llm_model):
+    """按影响转换器构造的参数缓存 MarkItDown 实例。
+
+    llm_prompt、keep_data_uris 只作为 convert 的关键字参数传入，不参与实例构造，
+    因此不放进缓存键：自定义提示词的请求也能复用同一实例。
     """
-    enable_plugins = args.get('enable_plugins', 'false').lower() == 'true'
-    use_docintel = args.get('use_docintel', 'false').lower() == 'true'
-    docintel_endpoint = args.get('docintel_endpoint')
-    use_llm = args.get('use_llm', 'false').lower() == 'true'
-    llm_model = args.get('llm_model', 'gpt-4o') # 默认模型
-    llm_prompt=args.get('llm_prompt',DEFAULT_LLM_PROMPT)
-    keep_data_uris=args.get('keep_data_uris', 'false').lower() == 'true'
-    md_kwargs = {'enable_plugins': enable_plugins,'keep_data_uris':keep_data_uris,"llm_prompt":llm_prompt}
+    md_kwargs = {'enable_plugins': enable_plugins}
 
-    if use_docintel and docintel_endpoint:
+    if docintel_endpoint:
         md_kwargs['docintel_endpoint'] = docintel_endpoint
         # 注意：可能需要配置 Azure 凭证，这里假设使用默认凭证链
         # from azure.identity import DefaultAzureCredential
         # md_kwargs['docintel_credential'] = DefaultAzureCredential()
-    if use_llm and AzureOpenAI and llm_model=='gpt-4o':
+    if llm_model=='gpt-4o':
         try:
-            # Azure OpenAI 配置从环境变量读取
-            openai_api_key = os.environ.get("AZURE_OPENAI_API_KEY","")
-            openai_api_base = os.environ.get("AZURE_OPENAI_ENDPOINT","")
-            openai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION", "2025-02-01-preview")
-            openai_deployment = llm_model
-
-            if not openai_api_key or not openai_api_base:
-                raise BadRequest("缺少 Azure OpenAI 配置，请设置环境变量。")
-
-            client = AzureOpenAI(
-                api_key=openai_api_key,
-                azure_endpoint=openai_api_base,
-                api_version=openai_api_version
-            )
-            md_kwargs['llm_client'] = client
+            md_kwargs['llm_client'] = _azure_openai_client()
             md_kwargs['llm_model'] = llm_model
-            # md_kwargs['llm_prompt'] = llm_prompt
         except Exception as e:
-            app.logger.warning(f"无法初始化 AzureOpenAI 客户端: {e}. LLM 功能将不可用。")
+            app.logger.warning("无法初始化 AzureOpenAI 客户端: %s. LLM 功能将不可用。", e)
             # 可以选择在这里报错或仅禁用 LLM
             pass # 或者 raise BadRequest("无法初始化 LLM 客户端，请检查 API Key")
 
-    if use_llm and OpenAI and llm_model=='Qwen2.5-VL-72B-Instruct':
+    if llm_model=='Qwen2.5-VL-72B-Instruct':
         # 注意：需要配置 OpenAI API Key，通常通过环境变量 OPENAI_API_KEY
         try:
-            # Azure OpenAI 配置从环境变量读取
-            # openai_api_key = os.environ.get("AZURE_OPENAI_API_KEY")
-            # openai_api_base = os.environ.get("AZURE_OPENAI_ENDPOINT")
-            # openai_api_version = os.environ.get("AZURE_OPENAI_API_VERSION", "2025-02-01-preview")
-            # openai_deployment = os.environ.get("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
-
-            # if not openai_api_key or not openai_api_base:
-            #     raise BadRequest("缺少 Azure OpenAI 配置，请设置环境变量。")
-
-            # client = AzureOpenAI(
-            #     api_key=openai_api_key,
-            #     azure_endpoint=openai_api_base,
-            #     api_version=openai_api_version
-            # )
-            
-            # OpenAI 配置从环境变量读取
-            openai_api_key = os.environ.get("OPENAI_API_KEY","")
-            openai_api_base = os.environ.get("OPENAI_API_BASE", "")
-            if not openai_api_key:
-                raise BadRequest("缺少 OpenAI 配置，请设置 OPENAI_API_KEY 环境变量。")
-
-            client = OpenAI(
-                api_key=openai_api_key,
-                base_url=openai_api_base
-            )
-            md_kwargs['llm_client'] = client
+            md_kwargs['llm_client'] = _openai_client()
             md_kwargs['llm_model'] = llm_model
-            # md_kwargs['llm_prompt'] = llm_prompt
-  
         except Exception as e:
-            app.logger.warning(f"无法初始化 OpenAI 客户端: {e}. LLM 功能将不可用。")
+            app.logger.warning("无法初始化 OpenAI 客户端: %s. LLM 功能将不可用。", e)
             # 可以选择在这里报错或仅禁用 LLM
             pass # 或者 raise BadRequest("无法初始化 LLM 客户端，请检查 API Key")
-    return MarkItDown(**md_kwargs),md_kwargs
+    return _import_markitdown().MarkItDown(**md_kwargs),md_kwargs
+
+# 默认的图片识别提示词，请求未指定 llm_prompt 时使用（字符串内容保持原样，包括行首缩进）
+DEFAULT_LLM_PROMPT = """你是一个专业的图片转换器，你需要根据图片中的内容判断是否符合以下某几个场景，输出markdown文本或者图片描述。
+    场景一：使用markdown语法，将图片中识别到的文字转换为markdown格式输出。你必须做到：
+    1. 输出和使用识别到的图片的相同的语言，例如，识别到英语的字段，输出的内容必须是英语。
+    2. 不要解释和输出无关的文字，直接输出图片中的内容。例如，严禁输出 “以下是我根据图片内容生成的markdown文本：”这样的例子，而是应该直接输出markdown。
+    3. 内容不要包含在```markdown ```中、段落公式使用 $$ $$ 的形式、行内公式使用 $ $ 的形式、忽略掉长直线、忽略掉页码。再次强调，不要解释和输出无关的文字，直接输出图片中的内容。
+    4. 对于图中文本之间包含特定关系，需使用思维导图、流程图等mermaid形式的mardown输出，保留文本之间的关联关系。
+    5. 对于图中的表格，需使用markdown表格的形式输出，保留表格结构。  
+    6. 忽略所有水印信息。
+    7. 文字中所有标红或者加粗或其它突出的部分，请用markdown的** **的格式标粗。
+    场景二：请对图片上的非文本元素（图表、照片、人像等）进行描述和总结。语言请参考"场景一"使用的语言，不存在“场景一”请使用中文。
+    """
+
+def get_markitdown_instance(args: Dict[str, str]) -> Tuple["MarkItDown", Dict[str, Any]]:
+    enable_plugins = args.get('enable_plugins', 'false').lower() == 'true'
+    use_docintel = args.get('use_docintel', 'false').lower() == 'true'
+    docintel_endpoint = args.get('docintel_endpoint')
+    use_llm = args.get('use_llm', 'false').lower() == 'true'
+    llm_model = args.get('llm_model', 'gpt-4o') # 默认模型
+    llm_prompt = args.get('llm_prompt', DEFAULT_LLM_PROMPT)
+    keep_data_uris=args.get('keep_data_uris', 'false').lower() == 'true'
+    md,md_kwargs = _build_md(enable_plugins,
+                             docintel_endpoint if use_docintel else None,
+                             llm_model if use_llm else None)
+    # 返回副本，避免调用方修改缓存中的参数
+    md_kwargs = dict(md_kwargs, keep_data_uris=keep_data_uris, llm_prompt=llm_prompt)
+    return md,md_kwargs
 
 # --- 文件处理和解析任务 ---
 def get_pdf_page_count(file_stream):
-    """尝试获取 PDF 页数，失败则返回 -1"""
+    """尝试获取 PDF 页数，失败则返回 -1
+
+    pypdf 只读取 xref 表和页树根节点，不需要像 pdfminer 那样完整解析文档。
+    真实文件会先 mmap，xref 查找（文件尾部 seek + 小块读取）直接命中页缓存。
+    """
     try:
-        from pdfminer.pdfparser import PDFParser
-        from pdfminer.pdfdocument import PDFDocument
-        parser = PDFParser(file_stream)
-        document = PDFDocument(parser)
-        return document.catalog.get('Pages').resolve().get('Count', -1)
-    except (PDFSyntaxError, PDFTextExtractionNotAllowed, Exception) as e:
-        # 捕获 pdfminer 可能的错误以及其他潜在问题
-        app.logger.error(f"获取 PDF 页数时出错: {e}")
+        import pypdf
+        try:
+            fileno = file_stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return pypdf.PdfReader(file_stream, strict=False).get_num_pages()
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mm:
+            return pypdf.PdfReader(mm, strict=False).get_num_pages()
+    except Exception as e:
+        # 捕获 pypdf 可能的错误以及其他潜在问题
+        app.logger.error("获取 PDF 页数时出错: %s", e)
         return -1 # 表示无法确定页数或文件无效
 
+def _convert(md, source, md_kwargs, filename=None):
+    """source 为文件路径，或保留在内存中的小文件内容（bytes）"""
+    if isinstance(source, bytes):
+        stream_info = _import_markitdown().StreamInfo(
+            extension=os.path.splitext(filename or '')[1] or None,
+            filename=filename,
+        )
+        return md.convert_stream(io.BytesIO(source), stream_info=stream_info, **md_kwargs).text_content
+    return md.convert(source, **md_kwargs).text_content
+
+def _parse(source, args, filename=None):
+    """在解析进程池中执行 MarkItDown 转换，只跨进程传递路径（或小文件内容）和请求参数"""
+    md,md_kwargs = get_markitdown_instance(args)
+    return _convert(md, source, md_kwargs, filename)
+
+def _render_pdf_pages(path, start, stop):
+    """在进程池中抽取 PDF 第 [start, stop) 页的文本；
+    每次调用都要重新打开文件、解析 xref 和页树，所以按连续页段而不是逐页分派"""
+    from pdfminer.high_level import extract_text
+    return extract_text(path, page_numbers=range(start, stop))
+
+def _normalize_text(text):
+    """与 MarkItDown.convert 的输出规范化保持一致：去除行尾空白并合并多余空行"""
+    text = "\n".join(line.rstrip() for line in re.split(r"\r?\n", text))
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+class _LimitedReader(io.RawIOBase):
+    """包装下载流，累计读取字节数超过 limit 时抛出 RequestURITooLarge"""
+
+    def __init__(self, raw, limit):
+        self._raw = raw
+        self._limit = limit
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._raw.readinto(b)
+        self.bytes_read += n or 0
+        if self.bytes_read > self._limit:
+            raise RequestURITooLarge("通过 URL 下载的文件超过大小限制")
+        return n
+
+# 复用下载缓冲区，避免每个分块都分配新的 bytes；按需创建，最多保留 MAX_WORKERS 个
+_chunk_pool = queue.LifoQueue(maxsize=MAX_WORKERS)
+
+def _copy_download(reader, f):
+    """通过 readinto 把下载流写入文件，缓冲区从 _chunk_pool 借用
+
+    网络读每次只返回一小段数据，这里先把缓冲区攒满再整块写入，
+    使每次 write 系统调用都尽量携带 IO_BUFFER_SIZE 字节。
+    """
+    try:
+        buf = _chunk_pool.get_nowait()
+    except queue.Empty:
+        buf = bytearray(IO_BUFFER_SIZE)
+    try:
+        view = memoryview(buf)
+        eof = False
+        while not eof:
+            filled = 0
+            while filled < len(view):
+                n = reader.readinto(view[filled:])
+                if not n:
+                    eof = True
+                    break
+                filled += n
+            # f 可能是无缓冲的 FileIO，write 允许只写入一部分
+            written = 0
+            while written < filled:
+                written += f.write(view[written:filled])
+    finally:
+        try:
+            _chunk_pool.put_nowait(buf)
+        except queue.Full:
+            pass
+
+def _remove_task_inputs(file_path_or_url, is_url, temp_file_path=None):
+    """任务结束后清理下载的临时文件和上传文件"""
+    if temp_file_path:
+        _safe_unlink(temp_file_path)
+    # 如果上传的文件也需要删除（取决于策略）
+    if not is_url and isinstance(file_path_or_url, (str, os.PathLike)) and _safe_unlink(file_path_or_url):
+        app.logger.info("删除临时上传文件: %s", file_path_or_url)
+
 def process_file(task_id, file_path_or_url, is_url, original_filename, content_type, args):
     """后台处理文件解析的任务"""
-    tasks[task_id]['status'] = 'processing'
-    file_stream = None
+    task = get_task(task_id)
+    if task is None:
+        # 任务已过期或被淘汰，无需继续处理，但上传的文件仍需删除
+        app.logger.warning("任务 %s 不存在或已过期，跳过处理", task_id)
+        _remove_task_inputs(file_path_or_url, is_url)
+        return
     temp_file_path = None
     downloaded = False
+    page_count = -1
+    page_counted = False
+    download_slot = False
     try:
+        task.status = 'processing'
+        set_task(task_id, task)
         md,md_kwargs = get_markitdown_instance(args)
-        metadata = tasks[task_id]['metadata']
+        metadata = task.metadata
 
         if is_url:
             # --- URL 处理 ---
+            # 占用一个下载名额，下载落盘完成后立即归还（异常时在 finally 中归还），解析不占名额
+            _download_slots.acquire()
+            download_slot = True
             response = requests.get(file_path_or_url, stream=True, timeout=30) # 增加超时
             response.raise_for_status() # 检查请求是否成功
 
             # 校验 Content-Type (如果服务器提供了)
-            url_content_type = response.headers.get('content-type', '').split(';')[0]
+            url_content_type = response.headers.get('content-type', '').partition(';')[0].strip()
             if url_content_type and url_content_type not in SUPPORTED_MIMETYPES:
-                app.logger.warning(f"不支持的 URL 内容类型: {url_content_type}")
+                app.logger.warning("不支持的 URL 内容类型: %s", url_content_type)
                 # raise BadRequest(f"不支持的文件类型: {url_content_type}")
 
             # 校验大小
@@ -268,47 +628,66 @@ def process_file(task_id, file_path_or_url, is_url, original_filename, content_t
             if content_length and int(content_length) > MAX_FILE_SIZE:
                 raise RequestURITooLarge("通过 URL 下载的文件超过大小限制")
 
-            # 下载到临时文件以传递给 markitdown
-            temp_file_path = os.path.join(UPLOAD_FOLDER, f"{task_id}_{secure_filename(original_filename or 'downloaded_file')}")
-            file_size = 0
-            with open(temp_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file_size += len(chunk)
-                    if file_size > MAX_FILE_SIZE:
-                        raise RequestURITooLarge("通过 URL 下载的文件超过大小限制")
-                    f.write(chunk)
-            downloaded = True
-            metadata['size'] = file_size
             metadata['mime_type'] = url_content_type or 'unknown' # 更新 MIME 类型
+            # 所有格式都先下载到临时文件再解析：markitdown 的 convert_stream 遇到不可 seek 的流
+            # 会把整个响应读进内存，边下载边解析既不能重叠，又要多占一份文件大小的内存
+            response.raw.decode_content = True
+            stream_input = _LimitedReader(response.raw, MAX_FILE_SIZE)
+            # _copy_download 每次写入整块 1 MiB，不需要再经过 BufferedWriter 复制一遍
+            download_name = _safe(original_filename or 'downloaded_file')
+            if not os.path.splitext(download_name)[1] and url_content_type:
+                # URL 中没有扩展名时按 Content-Type 补上，供 markitdown 识别格式
+                download_name += mimetypes.guess_extension(url_content_type) or ''
+            temp_file_path = UPLOAD_FOLDER / f"{task_id}_{download_name}"
+            with open(temp_file_path, 'w+b', buffering=0) as f:
+                downloaded = True
+                _copy_download(stream_input, f)
+                metadata['size'] = stream_input.bytes_read
+                if url_content_type == 'application/pdf' and metadata['size'] > SMALL_PDF_BYTES:
+                    # 复用仍然打开的下载句柄统计页数，省去一次重新打开和冷读
+                    f.flush()
+                    f.seek(0)
+                    page_count = get_pdf_page_count(f)
+                    page_counted = True
+            _download_slots.release()
+            download_slot = False
             file_to_process = temp_file_path
             processing_input = temp_file_path # Markitdown 可能需要路径
 
         else:
             # --- 文件流处理 ---
-            file_to_process = file_path_or_url # 这是初始保存的路径
-            metadata['size'] = os.path.getsize(file_to_process)
+            file_to_process = file_path_or_url # 这是初始保存的路径，小文件则是内存中的内容
+            if isinstance(file_to_process, bytes):
+                metadata['size'] = len(file_to_process)
+            else:
+                metadata['size'] = os.path.getsize(file_to_process)
             metadata['mime_type'] = content_type
             processing_input = file_to_process # Markitdown 可能需要路径
 
         # --- 通用校验和处理 ---
-        # PDF 页数校验 (仅对 PDF)
-        if metadata.get('mime_type') == 'application/pdf':
-            page_count = -1
-            try:
-                with open(file_to_process, 'rb') as f:
-                    page_count = get_pdf_page_count(f)
-            except Exception as e:
-                 app.logger.error(f"读取文件进行页数检查时出错 ({file_to_process}): {e}")
-                 raise InternalServerError("读取文件时出错")
+        # PDF 页数校验 (仅对 PDF，小文件跳过预检，省去一次额外的解析)
+        if metadata.get('mime_type') == 'application/pdf' and metadata['size'] > SMALL_PDF_BYTES:
+            if not page_counted:
+                try:
+                    if isinstance(file_to_process, bytes):
+                        page_count = get_pdf_page_count(io.BytesIO(file_to_process))
+                    else:
+                        with open(file_to_process, 'rb') as f:
+                            page_count = get_pdf_page_count(f)
+                except Exception as e:
+                     app.logger.error("读取文件进行页数检查时出错 (%s): %s", metadata.get('name'), e)
+                     raise InternalServerError("读取文件时出错")
 
             if page_count == -1:
-                 app.logger.warning(f"无法确定 PDF 页数: {metadata.get('name')}")
+                 app.logger.warning("无法确定 PDF 页数: %s", metadata.get('name'))
                  # 根据需求决定是否严格失败，这里选择警告并继续
                  metadata['pages'] = 'Unknown'
             elif page_count > MAX_PDF_PAGES:
                 raise BadRequest(f"文件页数超过限制 ({page_count}/{MAX_PDF_PAGES})")
             else:
                 metadata['pages'] = page_count
+        elif metadata.get('mime_type') == 'application/pdf':
+            metadata['pages'] = 'skipped'
 
         # --- 调用 MarkItDown ---
         # MarkItDown.convert 现在接受文件路径或流。如果需要流，需要打开文件。
@@ -317,239 +696,339 @@ def process_file(task_id, file_path_or_url, is_url, original_filename, content_t
         # with open(processing_input, 'rb') as f:
         #    result = md.convert(f)
         # 假设 convert 可以接受路径:
-        result = md.convert(processing_input,**md_kwargs)
+        if page_count > 1 and not isinstance(processing_input, bytes) and 'docintel_endpoint' not in md_kwargs and not md_kwargs.get('enable_plugins'):
+            # 多页 PDF：按进程数切成连续页段并行抽取，再按页序拼接（每页末尾自带分页符，与整篇抽取结果一致）
+            pages_per_task = -(-page_count // min(CPU_WORKERS, page_count))
+            futures = [cpu_executor.submit(_render_pdf_pages, processing_input, start,
+                                           min(start + pages_per_task, page_count))
+                       for start in range(0, page_count, pages_per_task)]
+            text_content = _normalize_text(''.join(future.result() for future in futures))
+        elif 'llm_client' in md_kwargs:
+            # 启用 LLM 时耗时主要在等待模型接口返回，留在 I/O 线程中执行，
+            # 不占用解析进程槽位，也复用本进程已建立连接的客户端
+            text_content = _convert(md, processing_input, md_kwargs, original_filename)
+        else:
+            text_content = cpu_executor.submit(_parse, processing_input, args, original_filename).result()
 
-        tasks[task_id]['status'] = 'success'
-        tasks[task_id]['result'] = result.text_content
+        # 大文档的 Markdown 可能有数 MB，结果写入磁盘，任务表里只保留路径
+        result_path = UPLOAD_FOLDER / f"{task_id}.md"
+        result_path.write_text(text_content, encoding='utf-8')
+        task.result_path = str(result_path)
+        task.status = 'success'
         # 可以考虑也存储 result.metadata
 
     except requests.exceptions.RequestException as e:
-        app.logger.error(f"下载 URL 时出错 ({file_path_or_url}): {e}")
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['error'] = f"下载文件失败: {e}"
+        app.logger.error("下载 URL 时出错 (%s): %s", file_path_or_url, e)
+        task.status = 'error'
+        task.error = f"下载文件失败: {e}"
     except BadRequest as e:
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['error'] = str(e.description)
+        task.status = 'error'
+        task.error = str(e.description)
     except RequestURITooLarge as e:
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['error'] = str(e.description)
+        task.status = 'error'
+        task.error = str(e.description)
     # except ConversionError as e:
-    #     app.logger.error(f"MarkItDown 解析失败 ({original_filename}): {e}")
-    #     tasks[task_id]['status'] = 'error'
-    #     tasks[task_id]['error'] = f"文件解析失败: {e}"
+    #     app.logger.error("MarkItDown 解析失败 (%s): %s", original_filename, e)
+    #     task.status = 'error'
+    #     task.error = f"文件解析失败: {e}"
     except Exception as e:
-        app.logger.exception(f"处理任务 {task_id} 时发生未知错误") # 使用 exception 记录堆栈
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['error'] = f"内部服务器错误: {e}"
+        app.logger.exception("处理任务 %s 时发生未知错误", task_id) # 使用 exception 记录堆栈
+        task.status = 'error'
+        task.error = f"内部服务器错误: {e}"
     finally:
-        # 清理临时文件
-        if downloaded and temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except OSError as e:
-                app.logger.error(f"无法删除临时下载文件 {temp_file_path}: {e}")
-        # 如果上传的文件也需要删除（取决于策略）
-        if not is_url and file_path_or_url and os.path.exists(file_path_or_url):
-             try:
-                 os.remove(file_path_or_url)
-                 app.logger.info(f"删除临时上传文件: {file_path_or_url}")
-             except OSError as e:
-                 app.logger.error(f"无法删除临时上传文件 {file_path_or_url}: {e}")
+        if download_slot:
+            _download_slots.release()
+        try:
+            # 保存终态（status 已在上面的分支中置为终态）
+            set_task(task_id, task)
+        finally:
+            # 无论保存是否成功，都要通知等待中的同步请求并清理临时文件
+            task.done.set()
+            _remove_task_inputs(file_path_or_url, is_url, temp_file_path if downloaded else None)
 
 
 # --- API 资源 ---
-class UploadResource(Resource):
-    def post(self):
-        task_id = str(uuid.uuid4())
-        file_path = None
-        is_url = False
-        original_filename = None
-        content_type = None
-        args = request.args.to_dict() # 获取查询参数 ?enable_plugins=true&...
+def _request_json():
+    """用 orjson 直接解析请求体，不经过 Flask 的缓存与解码；只接受 JSON 对象"""
+    try:
+        payload = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        raise BadRequest("请求体不是合法的 JSON")
+    return payload if isinstance(payload, dict) else {}
+
+def _precheck_url(url):
+    """校验 URL 并用 HEAD 预检，返回 (文件名, 内容类型)；过大的文件在创建任务前直接拒绝"""
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise BadRequest("无效的 URL 格式")
+    # 尝试从 URL 路径获取文件名（不含查询参数和片段）
+    original_filename = _safe(urlsplit(url).path.rpartition('/')[2] or 'downloaded_file')
+    # content_type 和 size 将在下载时确定
+    content_type = 'unknown'
+    # HEAD 失败时仍交给后台下载时校验
+    try:
+        head = requests.head(url, timeout=5, allow_redirects=True)
+    except requests.exceptions.RequestException:
+        head = None
+    if head is not None and head.ok:
+        head_content_type = head.headers.get('content-type', '').partition(';')[0].strip()
+        if head_content_type:
+            content_type = head_content_type
+            if head_content_type not in SUPPORTED_MIMETYPES:
+                app.logger.warning("不支持的 URL 内容类型: %s", head_content_type)
+        head_length = head.headers.get('content-length')
+        if head_length and head_length.isdigit() and int(head_length) > MAX_FILE_SIZE:
+            raise RequestURITooLarge("通过 URL 下载的文件超过大小限制")
+    return original_filename, content_type
+
+def _submit_task(task_id, source, is_url, original_filename, file_size, content_type, args):
+    """创建任务并提交后台处理；积压已满时撤销刚创建的任务并抛出 QueueFull"""
+    task = TaskStatus(
+        status="pending",
+        timestamp=time.time(),  # 新增字段，记录任务创建时间戳
+        metadata={
+            "name": original_filename,
+            "size": file_size if not is_url else 'pending download',
+            "mime_type": content_type,
+            "pages": "" # 稍后更新
+        }
+    )
+    set_task(task_id, task)
+    try:
+        io_executor.submit(process_file, task_id, source, is_url, original_filename, content_type, args)
+    except QueueFull:
+        delete_task(task_id)
+        raise
+    return task
+
+def _upload_batch(urls, args):
+    """批量 URL 上传：并发完成 HEAD 预检后逐个创建任务，单个 URL 失败不影响其他 URL"""
+    if not urls or len(urls) > MAX_PENDING_TASKS:
+        raise BadRequest(f"urls 数量必须在 1 到 {MAX_PENDING_TASKS} 之间")
+
+    def precheck(url):
         try:
-            if 'file' in request.files:
-                # --- 文件流上传 ---
-                file = request.files['file']
-                if file.filename == '':
-                    raise BadRequest("未选择文件")
-
-                original_filename = secure_filename(file.filename)
-                content_type = file.content_type
-
-                if content_type not in SUPPORTED_MIMETYPES:
-                    app.logger.warning(f"不支持的文件类型: {content_type}")
-                    # raise BadRequest(f"不支持的文件类型: {content_type}")
-
-                # 保存文件到临时位置
-                file_path = os.path.join(UPLOAD_FOLDER, f"{task_id}_{original_filename}")
-                file.save(file_path)
-
-                # 立即检查文件大小 (虽然 Flask 的 MAX_CONTENT_LENGTH 应该已经处理了)
-                file_size = os.path.getsize(file_path)
-                if file_size > MAX_FILE_SIZE:
-                    # 理论上不会到这里，除非 MAX_CONTENT_LENGTH 配置失效或文件在保存后变大
-                    raise RequestURITooLarge("文件超过大小限制")
-
-                app.logger.info(f"接收到文件: {original_filename}, 类型: {content_type}, 大小: {file_size}, 任务ID: {task_id}")
-
-
-            elif request.is_json and 'url' in request.json:
-                # --- URL 上传 ---
-                is_url = True
-                file_path_or_url = request.json['url']
-                if not file_path_or_url.startswith(('http://', 'https://')):
-                     raise BadRequest("无效的 URL 格式")
-                original_filename = file_path_or_url.split('/')[-1] # 尝试从 URL 获取文件名
-                # content_type 和 size 将在下载时确定
-                content_type = 'unknown'
-                file_size = 'unknown'
-                file_path = file_path_or_url # 传递 URL 给处理函数
-                app.logger.info(f"接收到 URL: {file_path_or_url}, 任务ID: {task_id}")
-
+            return _precheck_url(url), None
+        except (BadRequest, RequestURITooLarge) as e:
+            return None, str(e.description)
+
+    # 预检线程池只服务于本次请求，随 with 块结束销毁
+    with ThreadPoolExecutor(max_workers=min(len(urls), MAX_WORKERS)) as pool:
+        prechecks = list(pool.map(precheck, urls))
+
+    items = []
+    for url, (checked, error) in zip(urls, prechecks):
+        if error is None:
+            task_id = str(uuid.uuid4())
+            original_filename, content_type = checked
+            try:
+                task = _submit_task(task_id, url, True, original_filename, None, content_type, args)
+            except QueueFull:
+                error = "server busy"
             else:
-                raise BadRequest("请求必须包含 'file' (multipart/form-data) 或 'url' (json)")
-
-            # 初始化任务状态
-            tasks[task_id] = {
-                "status": "pending",
-                "result": None,
-                "error": None,
-                "timestamp": time.time(),  # 新增字段，记录任务创建时间戳
-                "metadata": {
-                    "name": original_filename,
-                    "size": file_size if not is_url else 'pending download',
-                    "mime_type": content_type,
-                    "pages": "" # 稍后更新
-                }
-                
-            }
-
-            # 提交后台处理
-            executor.submit(process_file, task_id, file_path, is_url, original_filename, content_type, args)
-
-            return jsonify({
-                "code": 200,
-                "message": "文件上传成功，正在处理中",
-                "data": {
-                    "task_id": task_id,
-                    "status": "pending",
-                    "metadata": tasks[task_id]['metadata']
-                }
-            })
-
-        except BadRequest as e:
-             # 如果在提交任务前发生错误，需要清理已保存的文件
-             if file_path and os.path.exists(file_path) and not is_url:
-                 try:
-                     os.remove(file_path)
-                 except OSError as rm_err:
-                     app.logger.error(f"无法删除部分上传的文件 {file_path}: {rm_err}")
-             return {"code": 400, "message": str(e.description), "data": None}, 400
-        except RequestURITooLarge as e:
-             if file_path and os.path.exists(file_path) and not is_url:
-                 try:
-                     os.remove(file_path)
-                 except OSError as rm_err:
-                     app.logger.error(f"无法删除过大的文件 {file_path}: {rm_err}")
-             return {"code": 413, "message": str(e.description), "data": None}, 413
-        except Exception as e:
-            app.logger.exception(f"上传处理中发生未知错误")
-            if file_path and os.path.exists(file_path) and not is_url:
-                 try:
-                     os.remove(file_path)
-                 except OSError as rm_err:
-                     app.logger.error(f"错误处理中无法删除文件 {file_path}: {rm_err}")
-            return {"code": 500, "message": "内部服务器错误", "data": None}, 500
-
-
-class ParseStatusResource(Resource):
-    # print(tasks)
-    def get(self, task_id):
-        task = get_task(task_id) #tasks.get(task_id)
-        if not task:
-            return {"code": 404, "message": "未找到任务", "data": None}, 404
-
-        response_data = {
-            "task_id": task_id,
-            "status": task.get('status'),
-            "metadata": task.get('metadata', {}),
-            "content": task.get('result'),
-            "error": task.get('error')
+                items.append({"url": url, "task_id": task_id, "status": "pending", "metadata": task.metadata})
+                continue
+        items.append({"url": url, "task_id": None, "error": error})
+    app.logger.info("接收到批量 URL: %d 个, 成功创建任务 %d 个", len(urls), sum(1 for i in items if i["task_id"]))
+
+    return jsonify({
+        "code": 200,
+        "message": "批量任务已提交，正在处理中",
+        "data": {
+            "task_ids": [i["task_id"] for i in items if i["task_id"]],
+            "tasks": items
         }
+    })
+
+def upload():
+    task_id = str(uuid.uuid4())
+    file_path = None
+    source = None  # 交给 process_file 的输入：文件路径、URL 或小文件内容
+    is_url = False
+    submitted = False
+    original_filename = None
+    content_type = None
+    args = request.args.to_dict() # 获取查询参数 ?enable_plugins=true&...
+    try:
+        payload = _request_json() if request.is_json else {}
+        if 'file' in request.files:
+            # --- 文件流上传 ---
+            file = request.files['file']
+            if file.filename == '':
+                raise BadRequest("未选择文件")
+
+            original_filename = _safe(file.filename)
+            content_type = file.content_type
+
+            if content_type not in SUPPORTED_MIMETYPES:
+                app.logger.warning("不支持的文件类型: %s", content_type)
+                # raise BadRequest(f"不支持的文件类型: {content_type}")
+
+            if isinstance(file.stream, io.BytesIO):
+                # 小文件：UploadRequest 已把内容留在内存中，直接交给后台任务
+                source = file.stream.getvalue()
+                file_size = len(source)
+            else:
+                # 保存文件到临时位置：UploadRequest 已把文件流式写入 UPLOAD_FOLDER，只需重命名
+                file_path = UPLOAD_FOLDER / f"{task_id}_{original_filename}"
+                part_path = getattr(file.stream, 'name', None)
+                if isinstance(part_path, str):
+                    file.stream.close()
+                    os.replace(part_path, file_path)
+                else:
+                    file.save(file_path)
+
+                # 大小上限已由 MAX_CONTENT_LENGTH 在读取请求体时强制执行，这里不再 stat 文件；
+                # 请求体长度包含 multipart 边界，精确大小在 process_file 中更新
+                file_size = request.content_length
+
+            app.logger.info("接收到文件: %s, 类型: %s, 大小: %s, 任务ID: %s", original_filename, content_type, file_size, task_id)
+
+
+        elif request.mimetype == 'application/octet-stream':
+            # --- 原始请求体上传：跳过 multipart 解析，直接单次拷贝到目标文件 ---
+            original_filename = _safe(request.headers.get('X-Filename') or 'uploaded_file')
+            content_type = mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
+            if request.content_length is not None and request.content_length <= IN_MEMORY_UPLOAD_BYTES:
+                source = request.get_data(cache=False)
+                file_size = len(source)
+            else:
+                file_path = UPLOAD_FOLDER / f"{task_id}_{original_filename}"
+                with open(file_path, 'wb', buffering=IO_BUFFER_SIZE) as f:
+                    shutil.copyfileobj(request.stream, f, length=IO_BUFFER_SIZE)
+                    file_size = f.tell()
+            app.logger.info("接收到文件: %s, 类型: %s, 大小: %s, 任务ID: %s", original_filename, content_type, file_size, task_id)
+
+        elif 'url' in payload:
+            # --- URL 上传 ---
+            is_url = True
+            file_path_or_url = payload['url']
+            # 先用 HEAD 预检，过大的文件在创建任务前直接拒绝
+            original_filename, content_type = _precheck_url(file_path_or_url)
+            file_size = 'unknown'
+            file_path = file_path_or_url # 传递 URL 给处理函数
+            app.logger.info("接收到 URL: %s, 任务ID: %s", file_path_or_url, task_id)
+
+        elif isinstance(payload.get('urls'), list):
+            # --- 批量 URL 上传 ---
+            return _upload_batch(payload['urls'], args)
 
-        if task.get('status') == 'error':
-            return jsonify({
-            "code": 400,
-            "message": "查询成功但出错",
-            "data": response_data
-        })
         else:
-            return jsonify({
+            raise BadRequest("请求必须包含 'file' (multipart/form-data)、原始文件内容 (application/octet-stream)、'url' 或 'urls' (json)")
+
+        # 初始化任务状态并提交后台处理
+        task = _submit_task(task_id, source if source is not None else file_path, is_url, original_filename, file_size, content_type, args)
+        submitted = True
+
+        return jsonify({
             "code": 200,
-            "message": "查询成功",
-            "data": response_data
+            "message": "文件上传成功，正在处理中",
+            "data": {
+                "task_id": task_id,
+                "status": "pending",
+                "metadata": task.metadata
+            }
         })
-        
-
-class UploadSyncResource(Resource):
-    def post(self):
-        # 获取初始响应
-        # print(Resource.__dict__)
-        upload_response = UploadResource().post()
-        # print(upload_response)
-        if isinstance(upload_response, tuple):
-            return upload_response  # 如果是错误响应，直接返回
-        
-        # 从响应中提取任务ID
-        task_id = upload_response.json['data']['task_id']
-        start_time = time.time()
-        timeout = 180  # 3分钟超时
-        
-        while True:
-            # 检查是否超时
-            if time.time() - start_time > timeout:
-                return jsonify({
-                    "code": 408,
-                    "message": "处理超时",
-                    "data": {
-                        "task_id": task_id,
-                        "status": "timeout"
-                    }
-                }), 408
-            
-            # 获取任务状态
-            status_response = ParseStatusResource().get(task_id)
-            if isinstance(status_response, tuple):
-                return status_response
-            
-            status_data = status_response.json['data']
-            
-            if status_data['status'] in ['success', 'error']:
-                return status_response
-            
-            # 使用非阻塞的 sleep
-            sleep(1)
-
-
-class AuditDocxRulesResource(Resource):
-    def post(self):
-        try:
-            if 'file' not in request.files:
-                return {"code": 400, "message": "缺少 docx 文件 (file)", "data": None}, 400
-            docx_file = request.files['file']
-            print(docx_file)
-            rules_path = './rules_p1.md'
-            # with  open("./validation_result.json", 'r', encoding='utf-8') as f:
-            #     result_dict = json.load(f)
-            result_dict = validate_and_output_json(docx_file, rules_path)
-            return {"code": 200, "message": "校验成功", "data": result_dict}
-        except Exception as e:
-            app.logger.exception(f"/api/v1/audit/docx/rules 校验异常: {e}")
-            return {"code": 500, "message": f"内部服务器错误: {e}", "data": None}, 500
 
-api.add_resource(AuditDocxRulesResource, '/api/v1/audit/docx/rules')
-api.add_resource(ParseStatusResource, '/api/v1/parse/<string:task_id>')
-api.add_resource(UploadSyncResource, '/api/v1/upload/parse')
+    except BadRequest as e:
+        return {"code": 400, "message": str(e.description), "data": None}, 400
+    except (RequestURITooLarge, RequestEntityTooLarge) as e:
+        # RequestEntityTooLarge 来自 Werkzeug 在读取请求体时执行的 MAX_CONTENT_LENGTH 限制
+        return {"code": 413, "message": str(e.description), "data": None}, 413
+    except QueueFull:
+        app.logger.warning("后台任务积压已达上限 (%d)，拒绝新任务", MAX_PENDING_TASKS)
+        return {"code": 503, "message": "server busy", "data": None}, 503
+    except Exception:
+        app.logger.exception("上传处理中发生未知错误")
+        return {"code": 500, "message": "内部服务器错误", "data": None}, 500
+    finally:
+        # 如果在提交任务前发生错误，需要清理已保存的文件
+        if not submitted and file_path and not is_url:
+            _safe_unlink(file_path)
+
+
+@app.route('/api/v1/parse/<string:task_id>', methods=['GET'])
+def parse_status(task_id):
+    task = get_task(task_id) #tasks.get(task_id)
+    if not task:
+        return {"code": 404, "message": "未找到任务", "data": None}, 404
+
+    response_data = {
+        "task_id": task_id,
+        "status": task.status,
+        "metadata": task.metadata or {},
+        "content": read_task_result(task),
+        "error": task.error
+    }
+
+    if task.status == 'error':
+        return jsonify({
+        "code": 400,
+        "message": "查询成功但出错",
+        "data": response_data
+    })
+    else:
+        return jsonify({
+        "code": 200,
+        "message": "查询成功",
+        "data": response_data
+    })
+    
+
+@app.route('/api/v1/upload/parse', methods=['POST'])
+def upload_sync():
+    # 获取初始响应
+    upload_response = upload()
+    # print(upload_response)
+    if isinstance(upload_response, tuple):
+        return upload_response  # 如果是错误响应，直接返回
+    
+    # 从响应中提取任务ID；批量提交不等待，直接返回各任务ID
+    data = upload_response.json['data']
+    if 'task_id' not in data:
+        return upload_response
+    task_id = data['task_id']
+    timeout = 180  # 3分钟超时
+
+    # 等待 process_file 发出完成信号，而不是每秒轮询一次
+    task = get_task(task_id)
+    if task is None or not task.done.wait(timeout=timeout):
+        return jsonify({
+            "code": 408,
+            "message": "处理超时",
+            "data": {
+                "task_id": task_id,
+                "status": "timeout"
+            }
+        }), 408
+
+    return parse_status(task_id)
+
+
+AUDIT_RULES_PATH = './rules_p1.md'
+
+def _audit(source, rules_path):
+    """在解析进程池中执行文档校验；source 为上传分片文件路径，或内存中的小文件内容（bytes）"""
+    # load_rules 按文件修改时间缓存解析结果，规则文件更新后无需重启即可生效
+    return validate_and_output_json(source, load_rules(rules_path))
+
+@app.route('/api/v1/audit/docx/rules', methods=['POST'])
+def audit_docx_rules():
+    try:
+        if 'file' not in request.files:
+            return {"code": 400, "message": "缺少 docx 文件 (file)", "data": None}, 400
+        docx_file = request.files['file']
+        # with  open("./validation_result.json", 'r', encoding='utf-8') as f:
+        #     result_dict = json.load(f)
+        # 校验是纯 Python 的 CPU 密集计算，交给进程池，避免并发校验在 Web 进程内争抢 GIL；
+        # 大文件已由 UploadRequest 落盘，只跨进程传递路径
+        part_path = getattr(docx_file.stream, 'name', None)
+        source = part_path if isinstance(part_path, str) else docx_file.read()
+        result_dict = cpu_executor.submit(_audit, source, AUDIT_RULES_PATH).result()
+        return {"code": 200, "message": "校验成功", "data": result_dict}
+    except Exception as e:
+        app.logger.exception("/api/v1/audit/docx/rules 校验异常: %s", e)
+        return {"code": 500, "message": f"内部服务器错误: {e}", "data": None}, 500
+
 
 # --- 错误处理 ---
 @app.errorhandler(400)
@@ -570,7 +1049,7 @@ def handle_payload_too_large(e):
 def handle_internal_error(e):
     # 对于 werkzeug 异常，原始异常在 e.original_exception
     error_message = str(e.description) if hasattr(e, 'description') else str(e)
-    app.logger.error(f"内部服务器错误: {error_message}") # 记录错误
+    app.logger.error("内部服务器错误: %s", error_message) # 记录错误
     return jsonify({"code": 500, "message": f"内部服务器错误: {error_message}", "data": None}), 500
 
 
@@ -581,8 +1060,7 @@ def temp_file(file_path):
     try:
         yield file_path
     finally:
-        if file_path.exists():
-            file_path.unlink()
+        file_path.unlink(missing_ok=True)
 
 
 
@@ -1,392 +1,407 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 from dataclasses import dataclass
 from wpsdoc import Document
-import json
+import functools
+import orjson
+import logging
+import os
 import re
-import io
+_log = logging.getLogger(__name__)
 WORD_LENGTH_THRESHOLD = 20
-@dataclass
-class Suggestion:
-    operation: str  # "替换" or "提醒"
-    after: str     # 替换后的内容，如果operation为"提醒"则为空
-
-@dataclass
-class Issue:
-    issueType: str
-    specificWord: str
-    sentence: str
-    suggestion: Suggestion
-    rule_id: str
-    additionalNotes: str
-
-@dataclass
+def _make_issue_dict(issueType: str, specificWord: str, sentence: str, operation: str, after: str,
+                     rule_id: str, additionalNotes: str) -> Dict[str, Any]:
+    """直接按输出 JSON 的结构构造一条问题；operation 为 "替换" 或 "提醒"，"提醒" 时 after 为空"""
+    return {
+        "issueType": issueType,
+        "specificWord": specificWord,
+        "sentence": sentence,
+        "suggestion": {"operation": operation, "after": after},
+        "rule_id": rule_id,
+        "additionalNotes": additionalNotes
+    }
+
+@dataclass(slots=True)
 class DocumentReviewResult:
-    issues: List[Issue]
+    issues: List[Dict[str, Any]]  # _make_issue_dict 构造的问题，已是最终输出结构
 
     def to_dict(self) -> Dict:
-        return {
-            "issues": [
-                {
-                    "issueType": issue.issueType,
-                    "specificWord": issue.specificWord,
-                    "sentence": issue.sentence,
-                    "suggestion": {
-                        "operation": issue.suggestion.operation,
-                        "after": issue.suggestion.after
-                    },
-                    "rule_id": issue.rule_id,
-                    "additionalNotes": issue.additionalNotes
-                }
-                for issue in self.issues
-            ]
-        }
+        return {"issues": self.issues}
 
 def load_rules(rules_file: str) -> Dict[str, Dict]:
-    """加载规则配置文件"""
+    """加载规则配置文件；按 (路径, 修改时间) 缓存解析结果，文件未变化时不再重复读取和解析。
+    返回的 dict 在调用方之间共享，只读使用"""
+    return _load_rules_cached(rules_file, os.path.getmtime(rules_file))
+
+@functools.lru_cache(maxsize=16)
+def _load_rules_cached(rules_file: str, mtime: float) -> Dict[str, Dict]:
     rules_data = {}
     with open(rules_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
         header_skipped = False
-        for line in lines:
+        for line in f:
             if not header_skipped:
                 if '---' in line: # Detect separator line after header
                     header_skipped = True
                 continue
-            if line.strip().startswith('|') and line.strip().endswith('|'):
-                parts = [p.strip() for p in line.split('|')[1:-1]] # Remove leading/trailing empty strings from split
+            # 每行只 strip 一次；先按列数筛选，只有规则行才逐格 strip
+            stripped = line.strip()
+            if len(stripped) > 1 and stripped[0] == '|' and stripped[-1] == '|':
+                parts = stripped[1:-1].split('|')
                 if len(parts) == 5:
-                    rule_id = parts[0]
+                    rule_id, type_scene, description, example, operation_suggestion = (p.strip() for p in parts)
                     rules_data[rule_id] = {
                         'id': rule_id,
-                        'type_scene': parts[1],
-                        'description': parts[2],
-                        'example': parts[3],
-                        'operation_suggestion': parts[4]
-                    } 
+                        'type_scene': type_scene,
+                        'description': description,
+                        'example': example,
+                        'operation_suggestion': operation_suggestion
+                    }
     return rules_data
 
-def validate_document(docx_file, rules_path: str) -> DocumentReviewResult:
-    """验证文档并返回问题列表，docx_file 可为文件路径或 file-like 对象"""
+# Chinese numeral conversion（一 .. 九千九百九十九，按位逐字计算）
+CN_DIGIT = {'一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+INT_DIGIT = {n: s for s, n in CN_DIGIT.items()}
+CN_UNIT = {'十': 10, '百': 100, '千': 1000}
 
-    if hasattr(docx_file, 'read'):
-        file_bytes = docx_file.read()
-        doc = Document(io.BytesIO(file_bytes))
-    else:
-        doc = Document(docx_file)
+@functools.lru_cache(maxsize=256)
+def simple_chinese_to_int(s: str) -> Optional[int]:
+    """解析中文序号（如 “十”、“十二”、“二十一”、“一百零五”），无法解析时返回 None"""
+    total = 0
+    digit = None
+    last_unit = 10000
+    for ch in s:
+        if ch in CN_DIGIT:
+            if digit is not None:
+                return None
+            digit = CN_DIGIT[ch]
+        elif ch in CN_UNIT:
+            unit = CN_UNIT[ch]
+            if unit >= last_unit:
+                return None
+            if digit is None:
+                # 只有开头的 “十” 可以省略系数（十二 = 一十二）
+                if unit != 10 or total:
+                    return None
+                digit = 1
+            total += digit * unit
+            digit = None
+            last_unit = unit
+        elif ch != '零' or digit is not None:
+            return None
+    if digit is not None:
+        total += digit
+    return total or None
+
+@functools.lru_cache(maxsize=256)
+def int_to_simple_chinese(n: int) -> Optional[str]:
+    if not 1 <= n <= 9999:
+        return None
+    parts = []
+    zero = False
+    for unit, name in ((1000, '千'), (100, '百'), (10, '十'), (1, '')):
+        d, n = divmod(n, unit)
+        if d:
+            if zero:
+                parts.append('零')
+                zero = False
+            if not (unit == 10 and d == 1 and not parts):
+                parts.append(INT_DIGIT[d])
+            parts.append(name)
+        elif parts:
+            zero = True
+    return ''.join(parts)
+
+# 中文序号字符和左括号，HEADING_RE 与首字符预筛选共用，避免两处各写一份而不一致
+CN_NUMERAL_CHARS = "一二三四五六七八九十百千零"
+OPEN_BRACKETS = "（("
+
+# 一次 match 判定标题层级：分支按层级顺序排列，命中的命名分组 l1..l4 即标题层级，分组内容为序号
+HEADING_RE = re.compile(
+    rf"^(?:(?P<l1>[{CN_NUMERAL_CHARS}]+)、"
+    rf"|[{OPEN_BRACKETS}](?P<l2>[{CN_NUMERAL_CHARS}]+)[)）]"
+    r"|(?P<l3>\d+)\."
+    rf"|[{OPEN_BRACKETS}](?P<l4>\d+)[)）])"
+)
+
+# 标题只可能以中文数字、括号或数字（由调用方用 isdigit 判断）开头；首字符不满足时不必进入正则引擎
+HEADING_FIRST_CHARS = frozenset(CN_NUMERAL_CHARS + OPEN_BRACKETS)
+
+# 按层级索引；level 0（“爱你在心口”）不参与标题识别，HEADING_RE 中没有对应分支
+HEADING_CONFIGS = [
+    {
+        'level': 0,
+        'jump_order_rule_id': '',
+        'font_style_rule_id': '15-02',
+        'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
+        'bold': False,
+        'numeral_type': 'arabic'
+    },
+    {
+        'level': 1,
+        'jump_order_rule_id': '05-05', # Corresponds to '标序问题-一级标题跳序问题' (from user's original code for L1)
+                                     # If rules_p1.md has '05-05' for L1, update this ID.
+        'font_style_rule_id': '06-05',
+        'font_rule': ['黑体', 'SimHei'],
+        'bold': True,
+        'numeral_type': 'chinese'
+    },
+    {
+        'level': 2,
+        'jump_order_rule_id': '05-03', # '标序问题-二级标题跳序问题'
+        'font_style_rule_id': '06-03',
+        'font_rule': ['楷体', 'KaiTi', 'STKaiti'],
+        'bold': False,
+        'numeral_type': 'chinese'
+    },
+    {
+        'level': 3,
+        'jump_order_rule_id': '05-04', # '标序问题-三级标题跳序问题'
+        'font_style_rule_id': '06-04',
+        'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
+        'bold': False,
+        'numeral_type': 'arabic'
+    },
+    {
+        'level': 4,
+        'jump_order_rule_id': '05-02', # Assuming a rule like '05-05' exists for L4 jump order based on previous structure.
+                                     # Please verify/add this rule to rules_p1.md if it's different or missing.
+                                     # The original code had a '05-05' for L4 in the `heading_configs` example.
+        'font_style_rule_id': '06-02',
+        'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
+        'bold': False,
+        'numeral_type': 'arabic'
+    }
+]
+
+# 字体名比较不区分大小写，小写形式在导入时算好
+for _config in HEADING_CONFIGS:
+    _config['font_rule_lower'] = tuple(f.lower() for f in _config['font_rule'])
+del _config
+
+# Standard two-character indent (value from original code)
+TWO_CHAR_INDENT_EMU = 2
+INDENT_TOLERANCE = 0
+FONT_SIZE = 16
+
+def check_font_style(p_obj, p_text_content: str, specific_word: str, config: Dict[str, Any],
+                     actual_font_name: Optional[str], actual_bold: Optional[bool],
+                     rule_info: Dict[str, str], size_rule_info: Dict[str, str], issues: List[Dict[str, Any]]):
+    """按 HEADING_CONFIGS 中的配置检查标题的字体、加粗和字号，发现的问题追加到 issues；
+    actual_font_name/actual_bold 为段落主字体（Paragraph.dominant_font_key），
+    rule_info/size_rule_info 为调用方预先取出的本层级字体规则和 15-02 字号规则；
+    specific_word 为调用方截好的 p_text_content[:WORD_LENGTH_THRESHOLD]"""
+    rule_id = config['font_style_rule_id']
+    expected_fonts = config['font_rule']
+    expected_bold = config['bold']
     
-    rules = load_rules(rules_path)
-    issues: List[Issue] = []
-
-    # Chinese numeral conversion helpers (ensure these are correctly defined and comprehensive)
-    def simple_chinese_to_int(s: str) -> Optional[int]:
-        mapping = {'一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10,
-                   '十一': 11, '十二': 12, '十三': 13, '十四': 14, '十五': 15, '十六': 16, '十七': 17, '十八': 18, '十九': 19, '二十':20}
-        # Extend this mapping as needed for numbers like 二十一, 三十, etc.
-        return mapping.get(s)
-
-    def int_to_simple_chinese(n: int) -> Optional[str]:
-        mapping = {1: '一', 2: '二', 3: '三', 4: '四', 5: '五', 6: '六', 7: '七', 8: '八', 9: '九', 10: '十',
-                   11: '十一', 12: '十二', 13: '十三', 14: '十四', 15: '十五', 16: '十六', 17: '十七', 18: '十八', 19: '十九', 20:'二十'}
-        # Extend this mapping as needed
-        return mapping.get(n)
-
-    heading_configs = [
-        {
-            'level': 0,
-            'pattern': re.compile(r"^爱你在心口.*?"),
-            'jump_order_rule_id': '',
-            'font_style_rule_id': '15-02',
-            'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
-            'bold': False,
-            'numeral_type': 'arabic'
-        },
-        {
-            'level': 1,
-            'pattern': re.compile(r"^([一二三四五六七八九十]+(?:[一二三四五六七八九])?)、"),
-            'jump_order_rule_id': '05-05', # Corresponds to '标序问题-一级标题跳序问题' (from user's original code for L1)
-                                         # If rules_p1.md has '05-05' for L1, update this ID.
-            'font_style_rule_id': '06-05',
-            'font_rule': ['黑体', 'SimHei'],
-            'bold': True,
-            'numeral_type': 'chinese'
-        },
-        {
-            'level': 2,
-            'pattern': re.compile(r"^[（(]([一二三四五六七八九十]+(?:[一二三四五六七八九])?)[)）]"),
-            'jump_order_rule_id': '05-03', # '标序问题-二级标题跳序问题'
-            'font_style_rule_id': '06-03',
-            'font_rule': ['楷体', 'KaiTi', 'STKaiti'],
-            'bold': False,
-            'numeral_type': 'chinese'
-        },
-        {
-            'level': 3,
-            'pattern': re.compile(r"^(\d+)\."),
-            'jump_order_rule_id': '05-04', # '标序问题-三级标题跳序问题'
-            'font_style_rule_id': '06-04',
-            'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
-            'bold': False,
-            'numeral_type': 'arabic'
-        },
-        {
-            'level': 4,
-            'pattern': re.compile(r"^[（(](\d+)[)）]"),
-            'jump_order_rule_id': '05-02', # Assuming a rule like '05-05' exists for L4 jump order based on previous structure.
-                                         # Please verify/add this rule to rules_p1.md if it's different or missing.
-                                         # The original code had a '05-05' for L4 in the `heading_configs` example.
-            'font_style_rule_id': '06-02',
-            'font_rule': ['仿宋', 'FangSong', 'FangSong_GB2312'],
-            'bold': False,
-            'numeral_type': 'arabic'
-        }
-    ]
-
-    collected_headings_by_level: List[List[Dict[str, Any]]] = [[] for _ in heading_configs]
-
-    # Standard two-character indent (value from original code)
-    TWO_CHAR_INDENT_EMU = 2 
-    INDENT_TOLERANCE = 0
-
-    def get_dominant_font_properties(paragraph) -> tuple[Optional[str], Optional[bool]]:
-        run_details = []
-        total_text_len = 0
-        for run in paragraph.runs:
-            run_text = run.text
-            if run_text.strip():
-                run_len = len(run_text)
-                run_details.append({
-                    'len': run_len,
-                    'font_name': run.font.name,
-                    'bold': run.font.bold,
-                })
-                total_text_len += run_len
-        
-        if not run_details or total_text_len == 0: return None, None
+    # Case-insensitive check for font name; if actual_font_name is None, font_ok is False
+    actual_font_lower = actual_font_name.lower() if actual_font_name else ""
+    font_ok = bool(actual_font_lower) and any(ef in actual_font_lower for ef in config['font_rule_lower'])
+    
+    bold_ok = True 
+    if expected_bold is True and not actual_bold:
+        bold_ok = False
+    elif expected_bold is False and actual_bold is True:
+        bold_ok = False
+    
+    # SimHei/黑体 is often inherently bold or its 'bold' flag is set, so if expected bold, it's ok.
+    if actual_font_lower in ("simhei", "黑体") and expected_bold is True:
+         bold_ok = True 
 
-        font_counts = {}
-        for rd in run_details:
-            key = (rd['font_name'], rd['bold'])
-            font_counts[key] = font_counts.get(key, 0) + rd['len']
-        
-        if not font_counts: return None, None
+    if not font_ok or not bold_ok:
+        notes = []
+        if not font_ok:
+            notes.append(f"字体应为 '{'/'.join(expected_fonts)}' 系列, 实际主要字体为 '{actual_font_name if actual_font_name else '未知'}'")
+        if not bold_ok:
+            expected_bold_str = "加粗" if expected_bold is True else ("不加粗" if expected_bold is False else "未指定")
+            actual_bold_str = "加粗" if actual_bold is True else ("不加粗" if actual_bold is False else "未明确")
+            notes.append(f"字体应 {expected_bold_str}, 实际 {actual_bold_str}")
         
-        dominant_font_key = max(font_counts, key=font_counts.get)
-        return dominant_font_key[0], dominant_font_key[1]
+        # Get ALL part as potential heading text; truncate if too long
+        heading_prefix = specific_word + "..." if len(p_text_content) > WORD_LENGTH_THRESHOLD else p_text_content
 
-    def check_font_style(p_obj, p_text_content: str, rule_id: str, expected_fonts: List[str], expected_bold: Optional[bool]):
-        actual_font_name, actual_bold = get_dominant_font_properties(p_obj)
-        rule_info = rules.get(rule_id, {})
-        
-        font_ok = False
-        if actual_font_name:
-            for ef in expected_fonts:
-                if ef.lower() in actual_font_name.lower(): # Case-insensitive check for font name
-                    font_ok = True
-                    break
-        # If actual_font_name is None, font_ok remains False
-        
-        bold_ok = True 
-        if expected_bold is True and not actual_bold:
-            bold_ok = False
-        elif expected_bold is False and actual_bold is True:
-            bold_ok = False
-        
-        # SimHei/黑体 is often inherently bold or its 'bold' flag is set, so if expected bold, it's ok.
-        if actual_font_name and actual_font_name.lower() in ["simhei", "黑体"] and expected_bold is True:
-             bold_ok = True 
-
-        if not font_ok or not bold_ok:
-            notes = []
-            if not font_ok:
-                notes.append(f"字体应为 '{'/'.join(expected_fonts)}' 系列, 实际主要字体为 '{actual_font_name if actual_font_name else '未知'}'")
-            if not bold_ok:
-                expected_bold_str = "加粗" if expected_bold is True else ("不加粗" if expected_bold is False else "未指定")
-                actual_bold_str = "加粗" if actual_bold is True else ("不加粗" if actual_bold is False else "未明确")
-                notes.append(f"字体应 {expected_bold_str}, 实际 {actual_bold_str}")
-            
-            heading_prefix = p_text_content# Get ALL part as potential heading text
-            if len(heading_prefix) > 20: heading_prefix = heading_prefix[:WORD_LENGTH_THRESHOLD] + "..." # Truncate if too long
-
-            issues.append(Issue(
-                issueType=rule_info.get('type_scene', f"格式问题-{rule_id}"),
-                specificWord=heading_prefix,
-                sentence=p_text_content,
-                suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
-                rule_id=rule_id,
-                additionalNotes=f"{rule_info.get('description', '标题格式问题')}: {'; '.join(notes)}"
-            ))
-        FONT_SIZE=16
-        notes = []
-        crt_size=""
-        # 15-02  
-        rule_info = rules.get("15-02", {})
-        if p_obj.size != FONT_SIZE and p_obj.size is not None:
-            # crt_size=p_obj.font.size 
-            notes.append(f"字号大小应为{FONT_SIZE}磅，实际为{p_obj.size}磅")
-            issues.append(Issue(
+        issues.append(_make_issue_dict(
+            issueType=rule_info.get('type_scene', f"格式问题-{rule_id}"),
+            specificWord=heading_prefix,
+            sentence=p_text_content,
+            operation=rule_info.get('operation_suggestion', "提醒"), after="",
+            rule_id=rule_id,
+            additionalNotes=f"{rule_info.get('description', '标题格式问题')}: {'; '.join(notes)}"
+        ))
+    notes = []
+    crt_size=""
+    # 15-02  
+    rule_info = size_rule_info
+    size = p_obj.size
+    if size != FONT_SIZE and size is not None:
+        # crt_size=p_obj.font.size 
+        notes.append(f"字号大小应为{FONT_SIZE}磅，实际为{size}磅")
+        issues.append(_make_issue_dict(
+            issueType=rule_info.get('type_scene', f"正文字号应为16磅"),
+            specificWord=p_obj.text[:WORD_LENGTH_THRESHOLD],
+            sentence=p_obj.text,
+            operation=rule_info.get('operation_suggestion', "提醒"), after="",
+            rule_id=rule_id,
+            additionalNotes=f"{rule_info.get('description', '字号错误')}: {'; '.join(notes)}"
+        ))
+
+    elif size is None:
+        for run in p_obj.runs:
+            run_size = run.font.size
+            if run_size != FONT_SIZE:
+                notes.append(f"字号大小应为{FONT_SIZE}磅，实际为{run_size}磅")
+                issues.append(_make_issue_dict(
                 issueType=rule_info.get('type_scene', f"正文字号应为16磅"),
-                specificWord=p_obj.text[:WORD_LENGTH_THRESHOLD],
-                sentence=p_obj.text,
-                suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
+                specificWord=run.text[:WORD_LENGTH_THRESHOLD],
+                sentence=run.text,
+                operation=rule_info.get('operation_suggestion', "提醒"), after="",
                 rule_id=rule_id,
                 additionalNotes=f"{rule_info.get('description', '字号错误')}: {'; '.join(notes)}"
             ))
 
-        elif p_obj.size is None:
-            for run in p_obj.runs:
-                if run.font.size != FONT_SIZE:
-                    notes.append(f"字号大小应为{FONT_SIZE}磅，实际为{run.font.size}磅")
-                    issues.append(Issue(
-                    issueType=rule_info.get('type_scene', f"正文字号应为16磅"),
-                    specificWord=run.text[:WORD_LENGTH_THRESHOLD],
-                    sentence=run.text,
-                    suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
-                    rule_id=rule_id,
-                    additionalNotes=f"{rule_info.get('description', '字号错误')}: {'; '.join(notes)}"
-                ))
+def heading_numeral_value(num_str: str, numeral_type: str) -> Optional[int]:
+    """把标题序号转换为整数，无法转换时返回 None"""
+    if numeral_type == 'chinese':
+        return simple_chinese_to_int(num_str)
+    try:
+        return int(num_str)
+    except ValueError:
+        return None
+
+# 标题记录为 (序号数值, 序号文本, 标题前缀, 段落文本) 元组，序号数值在识别标题时算好一次
+HEADING_VALUE, HEADING_NUM_STR, HEADING_PREFIX, HEADING_TEXT = range(4)
+
+def check_jump_order(current_heading: tuple, next_heading: tuple, config: Dict[str, Any],
+                     rule_info: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """比较同一层级相邻两个标题的序号，不连续时返回跳序问题；rule_info 为本层级的跳序规则"""
+    current_val = current_heading[HEADING_VALUE]
+    next_actual_val = next_heading[HEADING_VALUE]
+    if current_val is None or next_actual_val is None:
+        # Consider logging if numeral conversion failed for a detected heading
+        return None
+    if next_actual_val == current_val + 1:
+        return None
+
+    numeral_type = config['numeral_type']
+    jump_order_rule_id = config['jump_order_rule_id']
+    expected_num_val = current_val + 1
+    if numeral_type == 'chinese':
+        # Fallback to arabic digits if int_to_simple_chinese returns None
+        expected_num_val_str = int_to_simple_chinese(expected_num_val) or str(expected_num_val)
+    else:
+        expected_num_val_str = str(expected_num_val)
+
+    return _make_issue_dict(
+        issueType=rule_info.get('type_scene', f"标序问题-跳序问题 (L{config['level']})"),
+        specificWord=next_heading[HEADING_PREFIX], 
+        sentence=next_heading[HEADING_TEXT],
+        operation=rule_info.get('operation_suggestion', "提醒"), after="",
+        rule_id=jump_order_rule_id,
+        additionalNotes=rule_info.get('description', 
+            f"标题序号不连续。在 '{current_heading[HEADING_PREFIX]}' 之后，期望序号为 '{expected_num_val_str}'，实际为 '{next_heading[HEADING_NUM_STR]}'.")
+    )
+
+def validate_document(docx_file, rules: Union[str, Dict[str, Dict]]) -> DocumentReviewResult:
+    """验证文档并返回问题列表，docx_file 可为文件路径、文件内容（bytes）或 file-like 对象；
+    rules 可为规则文件路径，或 load_rules 预先解析好的规则（只读，可在请求间共享）"""
+
+    # Document 自己处理路径和 file-like 对象：直接读取并解码，不再先整体读出再包一层 BytesIO
+    doc = Document(docx_file)
+    
+    if isinstance(rules, str):
+        rules = load_rules(rules)
+    issues: List[Dict[str, Any]] = []
+
+    # 跳序检查在遍历段落时就地完成：每个层级只需记住上一个同级标题，
+    # 问题按层级暂存，最后再按层级顺序追加到 issues
+    prev_heading_by_level: List[Optional[tuple]] = [None for _ in HEADING_CONFIGS]
+    jump_issues_by_level: List[List[Dict[str, Any]]] = [[] for _ in HEADING_CONFIGS]
+
+    # 14-02 会对每个不合规的正文段落触发，规则文案在进入循环前取出一次
+    rule_info = rules.get("14-02", {})
+    indent_issue_type = rule_info.get('type_scene', "段落-自然段左空两字")
+    indent_operation = rule_info.get('operation_suggestion', "提醒")
+    indent_notes = rule_info.get('description', "段落首行应当左空二字")
+
+    # 各层级标题用到的规则同样只查一次，按层级索引
+    font_rules = [rules.get(config['font_style_rule_id'], {}) for config in HEADING_CONFIGS]
+    jump_rules = [rules.get(config['jump_order_rule_id'], {}) for config in HEADING_CONFIGS]
+    size_rule_info = rules.get("15-02", {})
 
     # Main loop to process paragraphs
     for p_idx, p in enumerate(doc.paragraphs):
-        with open("debug.csv", "a") as f:
-            f.write(f"{p_idx},{p.info}\n")  # Debug print from original, commented out
-           
+        # 先只读取文本，空段落在访问其他属性之前就跳过
         text_content = p.text # Use raw text for matching, strip later if needed for specificWord
-        # html_content = p.html # If needed
-        # first_line_indent = p.paragraph_format.first_line_indent # If needed
-        # print(f"{p_idx+1}: {first_line_indent},{text_content[:50]}\n") # Debug print from original, commented out
-
-        if not text_content.strip(): # Skip empty or whitespace-only paragraphs
+        stripped_text_content = text_content.strip()
+        if not stripped_text_content: # Skip empty or whitespace-only paragraphs
             continue
+        # 问题摘录（specificWord）每段只截取一次，标题字体和首行缩进检查共用
+        specific_word = stripped_text_content[:WORD_LENGTH_THRESHOLD]
+
+        # 段落调试信息只在开启 DEBUG 日志时输出，不再为每个段落追加写 debug.csv
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("%d,%s", p_idx, p.info)
+
+        c0 = text_content[0]
+        match = HEADING_RE.match(text_content) if c0 in HEADING_FIRST_CHARS or c0.isdigit() else None
+        is_any_known_heading = match is not None
+        if is_any_known_heading:
+            level_idx = int(match.lastgroup[1:])
+            config = HEADING_CONFIGS[level_idx]
+            num_str = match.group(match.lastgroup)
+            # Store stripped text for sentence context
+            heading = (heading_numeral_value(num_str, config['numeral_type']), num_str,
+                       match.group(0), stripped_text_content)
+            if prev_heading_by_level[level_idx] is not None:
+                jump_issue = check_jump_order(prev_heading_by_level[level_idx], heading, config, jump_rules[level_idx])
+                if jump_issue is not None:
+                    jump_issues_by_level[level_idx].append(jump_issue)
+            prev_heading_by_level[level_idx] = heading
 
-        is_any_known_heading = False
-        for level_idx, config in enumerate(heading_configs):
-            match = config['pattern'].match(text_content)
-            if match and level_idx!=0:
-                is_any_known_heading = True
-                numeral_part_str = match.group(1)
-                full_heading_prefix = match.group(0)
-                
-                collected_headings_by_level[level_idx].append({
-                    'num_str': numeral_part_str,
-                    'text': text_content.strip(), # Store stripped text for sentence context
-                    'paragraph_obj': p,
-                    'prefix': full_heading_prefix
-                })
-                
-                # Check font style for this heading
-                check_font_style(p, text_content.strip(), 
-                                 config['font_style_rule_id'], 
-                                 config['font_rule'], 
-                                 config['bold'])
-                break # Paragraph is classified as one heading type, move to next paragraph
+            # Check font style for this heading; the dominant font is precomputed by Paragraph
+            dom_font, dom_bold = p.dominant_font_key
+            check_font_style(p, stripped_text_content, specific_word, config, dom_font, dom_bold,
+                             font_rules[level_idx], size_rule_info, issues)
 
         # Paragraph indentation and hanging indent checks (Rules 14-02, 14-03)
         if not is_any_known_heading: 
-            stripped_text_content = text_content.strip()
             # Rule 14-02: 段落-自然段左空两字
             first_line_indent = p.paragraph_format.first_line_indent
             if first_line_indent is None or first_line_indent != TWO_CHAR_INDENT_EMU: 
-                rule_info = rules.get("14-02", {})
-                issues.append(Issue(
-                    issueType=rule_info.get('type_scene', "段落-自然段左空两字"),
-                    specificWord=stripped_text_content[:WORD_LENGTH_THRESHOLD],
-                    sentence=stripped_text_content,
-                    suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
-                    rule_id="14-02",
-                    additionalNotes=rule_info.get('description', "段落首行应当左空二字")
-                ))
+                issues.append(_make_issue_dict(indent_issue_type, specific_word,
+                                               stripped_text_content, indent_operation, "", "14-02", indent_notes))
             
             # Rule 14-03: 段落- 回行顶格
             # left_indent = p.paragraph_format.left_indent
             # if left_indent is not None and left_indent > INDENT_TOLERANCE: 
             #     rule_info = rules.get("14-03", {})
-            #     issues.append(Issue(
+            #     issues.append(_make_issue_dict(
             #         issueType=rule_info.get('type_scene', "段落- 回行顶格"),
             #         specificWord=stripped_text_content[:WORD_LENGTH_THRESHOLD],
             #         sentence=stripped_text_content,
-            #         suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
+            #         operation=rule_info.get('operation_suggestion', "提醒"), after="",
             #         rule_id="14-03",
             #         additionalNotes=rule_info.get('description', "段落回行应顶格（段落整体左侧不应有额外缩进）")
             #     ))
 
-    # Check for jump-order issues in collected headings
-    for level_idx, headings_at_this_level in enumerate(collected_headings_by_level):
-        config = heading_configs[level_idx]
-        numeral_type = config['numeral_type']
-        jump_order_rule_id = config['jump_order_rule_id']
-
-        for i in range(len(headings_at_this_level) - 1):
-            current_heading = headings_at_this_level[i]
-            next_heading = headings_at_this_level[i+1]
-
-            current_val: Optional[int] = None
-            next_actual_val: Optional[int] = None
-            expected_next_num_str_func = str # Default for arabic if not chinese
-
-            if numeral_type == 'chinese':
-                current_val = simple_chinese_to_int(current_heading['num_str'])
-                next_actual_val = simple_chinese_to_int(next_heading['num_str'])
-                expected_next_num_str_func = int_to_simple_chinese
-            elif numeral_type == 'arabic':
-                try:
-                    current_val = int(current_heading['num_str'])
-                    next_actual_val = int(next_heading['num_str'])
-                except ValueError:
-                    # Log or handle non-integer numerals if they are not expected
-                    # print(f"Warning: Could not convert numeral '{current_heading['num_str']}' or '{next_heading['num_str']}' to int for level {config['level']}")
-                    continue 
-            
-            if current_val is not None and next_actual_val is not None:
-                if next_actual_val != current_val + 1:
-                    rule_info = rules.get(jump_order_rule_id, {})
-                    expected_num_val = current_val + 1
-                    expected_num_val_str = expected_next_num_str_func(expected_num_val)
-                    if expected_num_val_str is None and numeral_type == 'chinese': # Fallback if int_to_simple_chinese returns None
-                        expected_num_val_str = str(expected_num_val) 
-                    elif expected_num_val_str is None: # Should not happen for arabic if conversion was successful
-                         expected_num_val_str = "?"
-
-                    issues.append(Issue(
-                        issueType=rule_info.get('type_scene', f"标序问题-跳序问题 (L{config['level']})"),
-                        specificWord=next_heading['prefix'], 
-                        sentence=next_heading['text'],
-                        suggestion=Suggestion(operation=rule_info.get('operation_suggestion', "提醒"), after=""),
-                        rule_id=jump_order_rule_id,
-                        additionalNotes=rule_info.get('description', 
-                            f"标题序号不连续。在 '{current_heading['prefix']}' 之后，期望序号为 '{expected_num_val_str}'，实际为 '{next_heading['num_str']}'.")
-                    ))
-            # else: Consider logging if numeral conversion failed for a detected heading
+    for jump_issues in jump_issues_by_level:
+        issues.extend(jump_issues)
 
     return DocumentReviewResult(issues=issues)
 
-def validate_and_output_json(docx_file, rules_path: str) -> dict:
-    """验证文档并输出JSON结果，适配 Flask 文件对象输入，直接返回 dict"""
+def validate_and_output_json(docx_file, rules: Union[str, Dict[str, Dict]], output_path: Optional[str] = None) -> dict:
+    """验证文档并返回结果 dict，适配 Flask 文件对象输入；指定 output_path 时同时写入 JSON 文件"""
     # docx_file 可以是文件路径或 file-like 对象
     # 直接将 docx_file 传递给 validate_document，由它处理路径或文件对象
-    result = validate_document(docx_file, rules_path)
+    result = validate_document(docx_file, rules)
     result_dict = result.to_dict()
-    for issue in result_dict.get('issues', []):
-        if 'suggestion' in issue and 'after' not in issue['suggestion']:
-            issue['suggestion']['after'] = ""
-    output_path = "./validation_result.json"
     if output_path:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result_dict, f, ensure_ascii=False, indent=4)
-            # f.write(str(result_dict).replace("'", '"'))
+        # orjson 直接输出 UTF-8 字节（中文不转义），整段一次写入；
+        # 默认输出紧凑格式，设置 PRETTY_JSON 环境变量时缩进便于人工查看
+        option = orjson.OPT_INDENT_2 if os.environ.get("PRETTY_JSON") else 0
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(result_dict, option=option))
             print(f"校验完成，结果已保存到 {output_path}")
-    # 
     return result_dict
-    
-    # The following lines for writing to output_path and returning json_str are now effectively dead code
-    # as the function returns result_dict earlier. This might need further review based on requirements.
-    # json_str = json.dumps(result_dict, ensure_ascii=False, indent=4)
-    # 
-    # if output_path:
-    #     with open(output_path, 'w', encoding='utf-8') as f:
-    #         f.write(json_str)
-    #         print(f"校验完成，结果已保存到 {output_path}")
-    # 
-    # return json_str
 
 if __name__ == "__main__":
     # 使用示例文件进行测试
@@ -399,4 +414,4 @@ if __name__ == "__main__":
     print(f"使用规则文件: {rules_file}")
     
     # 执行校验并输出到文件
-    validate_and_output_json(docx_file, rules_file)
+    validate_and_output_json(docx_file, rules_file, output_file)
@@ -1,14 +1,28 @@
-import re
+from collections import Counter
+from html import unescape
+from html.parser import HTMLParser
 from typing import IO
 
+try:
+    # 可选依赖：安装了 lxml 时用其 C 实现的 HTML 解析器，否则退回标准库 HTMLParser
+    from lxml import etree as _lxml_etree
+    from lxml import html as _lxml_html
+except ImportError:
+    _lxml_html = None
+
 class Run:
+    __slots__ = ('text', 'html', 'font')
+
     def __init__(self, text,html, font_name, bold, font_size):
-        self.text = text.replace("&nbsp;", " ")
+        # &nbsp; 解码后为 \xa0，统一成普通空格
+        self.text = text.replace("\xa0", " ")
         self.html = html
         self.font = Font(font_name, bold, font_size)
 
 
 class Font:
+    __slots__ = ('name', 'bold', 'size')
+
     def __init__(self, name, bold, size):
         self.name = name
         self.bold = bold
@@ -16,12 +30,17 @@ class Font:
 
 
 class ParagraphFormat:
+    __slots__ = ('first_line_indent', 'left_indent')
+
     def __init__(self):
         self.first_line_indent = None
         self.left_indent = None
 
 
 class Paragraph:
+    # 长文档会生成大量段落/run 对象，使用 __slots__ 省去每个实例的 __dict__
+    __slots__ = ('runs', 'type', 'text', 'html', 'paragraph_format', 'font', 'bold', 'size', 'dominant_font_key')
+
     def __init__(self, runs):
         self.runs = runs
         self.type = ""
@@ -29,17 +48,41 @@ class Paragraph:
         self.html = ''.join([run.html for run in runs])
         self.paragraph_format = ParagraphFormat()
         self._set_font_properties()
-        self.info=f"{self.font},{self.bold},{self.size},{self.paragraph_format.first_line_indent},{self.paragraph_format.left_indent},{self.text}"
-        
+
+    @property
+    def info(self):
+        # 仅调试输出使用，按需拼接；首行缩进在构造后才会设置，这里读到的是当前值
+        return f"{self.font},{self.bold},{self.size},{self.paragraph_format.first_line_indent},{self.paragraph_format.left_indent},{self.text}"
 
     def _set_font_properties(self):
-        font_names = set([run.font.name for run in self.runs])
-        font_sizes = set([run.font.size for run in self.runs])
-        bold_values = set([run.font.bold for run in self.runs])
+        # 一次遍历 run：段落级的字体/加粗/字号只有所有 run 一致时才有值，出现不一致即置为 None；
+        # 同时按字符数统计占比最大的 (字体, 加粗) 组合
+        runs = self.runs
+        if len(runs) == 1:
+            # 单个 run 的段落（最常见）天然一致，直接取该 run 的属性
+            run_font = runs[0].font
+            self.font, self.bold, self.size = run_font.name, run_font.bold, run_font.size
+            self.dominant_font_key = (run_font.name, run_font.bold) if runs[0].text.strip() else (None, None)
+            return
+        font = bold = size = None
+        font_counts = Counter()
+        for i, run in enumerate(runs):
+            run_font = run.font
+            if not i:
+                font, bold, size = run_font.name, run_font.bold, run_font.size
+            else:
+                if font is not None and run_font.name != font: font = None
+                if bold is not None and run_font.bold != bold: bold = None
+                if size is not None and run_font.size != size: size = None
+            run_text = run.text
+            if run_text.strip():  # 空白 run 不参与主字体统计
+                font_counts[(run_font.name, run_font.bold)] += len(run_text)
 
-        self.font = font_names.pop() if len(font_names) == 1 else None
-        self.bold = bold_values.pop() if len(bold_values) == 1 else None
-        self.size = font_sizes.pop() if len(font_sizes) == 1 else None
+        self.font = font
+        self.bold = bold
+        self.size = size
+        # 并列时取最先出现的组合
+        self.dominant_font_key = font_counts.most_common(1)[0][0] if font_counts else (None, None)
     def set_type(self, type: str, level: int = None):
         """设置段落类型
         :param type: 段落类型（body/heading）
@@ -58,63 +101,200 @@ class Paragraph:
         self._keep_original_style()
 
 
-class DocumentObject:
-    def __init__(self, html_string):
-        # 提取<body></body>里的内容
-        pattern = r'<body.*?>(.*?)</body>'
-        match = re.search(pattern, html_string, re.DOTALL)
-        if match:
-            body_content = match.group(1)
-        else:
-            body_content = ""
-        # 提取段落信息，假设段落以<p class=MsoNormal>标签分隔
-        paragraph_pattern = r'<p class=.*?>.*?</p>'
-        paragraph_matches = re.findall(paragraph_pattern, body_content, re.DOTALL)
+def _parse_style(style):
+    """把 style 属性解析为 {属性名: 值}，同名属性以第一次出现的为准"""
+    props = {}
+    for decl in style.split(';'):
+        name, sep, value = decl.partition(':')
+        if sep:
+            name = name.strip().lower()
+            if name not in props:
+                props[name] = value.strip()
+    return props
+
+
+def _to_int(value):
+    """'16.0pt' / '2.0' 之类的数值转为整数，无法解析时返回 None"""
+    if value.endswith('pt'):
+        value = value[:-2]
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def _apply_style(style, run, indent):
+    """从标签的 style 属性补全 run 的字体/字号（run 为 [字体, 字号] 或 None），返回段落首行缩进"""
+    props = _parse_style(style)
+    if indent is None and 'mso-char-indent-count' in props:
+        indent = _to_int(props['mso-char-indent-count'])
+    if run is not None:
+        if run[0] is None and 'font-family' in props:
+            run[0] = props['font-family']
+        if run[1] is None and 'font-size' in props:
+            run[1] = _to_int(props['font-size'])
+    return indent
+
+
+def _new_paragraph(runs, indent):
+    paragraph = Paragraph(runs)
+    paragraph.paragraph_format.first_line_indent = indent
+    #回行顶格不需要校验（mso-list 的 margin-left 不再提取为 left_indent）
+    return paragraph if paragraph.text != " " else None
+
+
+class _DocumentParser(HTMLParser):
+    """流式解析 WPS 导出的 HTML，只收集 <body> 内带 class 的 <p> 段落，
+    段落中最外层的 <span>（连同嵌套标签里的文本）为一个 run"""
+
+    def __init__(self):
+        # 实体自行处理，run.html 保留原始写法
+        super().__init__(convert_charrefs=False)
         self.paragraphs = []
-        for para_match in paragraph_matches:
-            run_pattern = r'<span.*?>.*?</span>'
-            run_matches = re.findall(run_pattern, para_match, re.DOTALL)
-            # 去除 HTML 标签，只保留文本内容
-            runs=[]
-            for run_match in run_matches:
-                clean_text = re.sub(r'<[^>]+>', '', run_match)
-                # 简单假设字体信息从<p>标签的 style 属性中提取
-                font_name_pattern = r'font-family:([^;]+);'
-                font_name_match = re.search(font_name_pattern, run_match)
-                font_name = font_name_match.group(1) if font_name_match else None
-                font_size_pattern = r'font-size:([^;]+)pt;'
-                font_size_match = re.search(font_size_pattern, run_match)
-                font_size = int(float(font_size_match.group(1))) if font_size_match else None
-                bold = None  # 这里简单假设无法直接从示例中提取 bold 信息
-                run = Run(clean_text,run_match, font_name, bold, font_size)
-                runs.append(run)
-            paragraph = Paragraph(runs)
-            # 提取首行缩进信息
-            first_line_indent_pattern = r'mso-char-indent-count:([^;]+);'
-            first_line_indent_match = re.search(first_line_indent_pattern , para_match)
-            if first_line_indent_match:
-                paragraph.paragraph_format.first_line_indent = int(float(first_line_indent_match.group(1)))
-            
-            #回行顶格不需要校验
-            # left_indent_pattern = r'mso-list:l1 level1 lfo1; margin-left:([^;]+);'
-            # left_indent_match = re.search(left_indent_pattern, para_match)
-            # if left_indent_match:
-            #     paragraph.paragraph_format.left_indent = int(float(left_indent_match.group(1)))
-
-            if(paragraph.text!="&nbsp;" and paragraph.text != " "):
+        self._in_body = False
+        self._runs = None      # 当前段落已收集的 run，None 表示不在段落内
+        self._indent = None
+        self._run = None       # 当前 run: [字体, 字号, 文本片段, html 片段]
+        self._span_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self._in_body = True
+            return
+        if not self._in_body:
+            return
+        if self._runs is None:
+            if tag == 'p' and any(name == 'class' for name, _ in attrs):
+                self._runs = []
+                self._indent = None
+            else:
+                return
+        run = self._run
+        if tag == 'span':
+            if run is None:
+                run = self._run = [None, None, [], []]
+            self._span_depth += 1
+        if run is not None:
+            run[3].append(self.get_starttag_text())
+        for name, value in attrs:
+            if name == 'style' and value:
+                self._indent = _apply_style(value, run, self._indent)
+                break
+
+    def handle_endtag(self, tag):
+        if tag == 'body':
+            # 未闭合的段落不计入
+            self._in_body = False
+            self._runs = self._run = None
+            return
+        run = self._run
+        if run is not None:
+            run[3].append(f'</{tag}>')
+            if tag == 'span':
+                self._span_depth -= 1
+                if not self._span_depth:
+                    # bold 无法直接从 WPS 导出的 HTML 中提取，保持 None
+                    self._runs.append(Run(''.join(run[2]), ''.join(run[3]), run[0], None, run[1]))
+                    self._run = None
+        if tag == 'p' and self._runs is not None:
+            paragraph = _new_paragraph(self._runs, self._indent)
+            if paragraph is not None:
                 self.paragraphs.append(paragraph)
+            self._runs = self._run = None
+            self._span_depth = 0
+
+    def handle_data(self, data):
+        if self._run is not None:
+            self._run[2].append(data)
+            self._run[3].append(data)
+
+    def _handle_ref(self, raw):
+        if self._run is not None:
+            self._run[2].append(unescape(raw))
+            self._run[3].append(raw)
+
+    def handle_entityref(self, name):
+        self._handle_ref(f'&{name};')
+
+    def handle_charref(self, name):
+        self._handle_ref(f'&#{name};')
+
+
+def _outer_spans(element):
+    for child in element:
+        if child.tag == 'span':
+            yield child
+        elif isinstance(child.tag, str):
+            yield from _outer_spans(child)
+
+
+def _parse_with_lxml(html_content):
+    """lxml 版本的段落提取，结果与 _DocumentParser 一致（run.html 为 lxml 序列化后的写法）"""
+    if isinstance(html_content, bytes):
+        # 按字节直接交给 C 解析器，与标准库路径一样按 UTF-8 解码
+        parser = _lxml_html.HTMLParser(encoding='utf-8')
+    else:
+        parser = None
+    try:
+        root = _lxml_html.document_fromstring(html_content, parser=parser)
+    except _lxml_etree.ParserError:  # 空文档
+        return []
+    body = root.find('body')
+    if body is None:
+        return []
+    paragraphs = []
+    for p in body.iter('p'):
+        if p.get('class') is None:
+            continue
+        # 首行缩进取段落内（含 <p> 本身）按文档顺序第一个 mso-char-indent-count
+        indent = None
+        for el in p.iter():
+            style = el.get('style') if isinstance(el.tag, str) else None
+            if style:
+                indent = _apply_style(style, None, indent)
+                if indent is not None:
+                    break
+        runs = []
+        for span in _outer_spans(p):
+            run = [None, None]
+            for el in span.iter():
+                style = el.get('style') if isinstance(el.tag, str) else None
+                if style:
+                    _apply_style(style, run, indent)
+            runs.append(Run(span.text_content(), _lxml_html.tostring(span, encoding='unicode', with_tail=False),
+                            run[0], None, run[1]))
+        paragraph = _new_paragraph(runs, indent)
+        if paragraph is not None:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+
+class DocumentObject:
+    def __init__(self, html_string):
+        """html_string 为 HTML 文本，或 UTF-8 编码的字节"""
+        if _lxml_html is not None:
+            self.paragraphs = _parse_with_lxml(html_string)
+            return
+        if isinstance(html_string, bytes):
+            html_string = html_string.decode('utf-8')
+        parser = _DocumentParser()
+        parser.feed(html_string)
+        parser.close()
+        self.paragraphs = parser.paragraphs
 
-def Document(html: str | IO[bytes] | None = None) -> DocumentObject:
+def Document(html: str | bytes | IO[bytes] | None = None) -> DocumentObject:
     if isinstance(html, str):
         # 处理文件路径
-        with open(html, 'r') as f:
+        # 按字节读取，解码交给 DocumentObject（lxml 可直接解析字节）
+        with open(html, 'rb') as f:
             html_content = f.read()
+    elif isinstance(html, (bytes, bytearray)):
+        # 已在内存中的文件内容，不必再包一层 BytesIO
+        html_content = bytes(html)
     elif hasattr(html, 'read'):
         # 处理文件对象
+        # 读取到的字节由 DocumentObject 按 UTF-8 解码
         html_content = html.read()
-        # 如果读取到的是字节，则需要解码
-        if isinstance(html_content, bytes):
-            html_content = html_content.decode('utf-8')  # 使用适当的编码进行解码
     else:
         raise ValueError("Invalid input type")
     